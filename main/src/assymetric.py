@@ -3,9 +3,10 @@ import sys
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.asymmetric.x448 import X448PrivateKey
-from cryptography.hazmat.primitives.asymmetric.ed448 import Ed448PrivateKey
+from cryptography.hazmat.primitives.asymmetric.ed448 import Ed448PrivateKey, Ed448PublicKey
 from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
-from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from crypto_utility import Signature_scheme, Batch_signature_verifier
 
 
 # Asymmetric cryptography is a branch of cryptography where a secret key can be divided into two parts, 
@@ -29,6 +30,7 @@ class Assymetric_Ed25519_signing():
     def __init__(self):
         self.author         = 'Busari Habibullaah'
         self.description    = 'Ed25519 crypted message signing'
+        self.verification_cache = None  # optional crypto_utility.Signature_verification_cache
 
     def generate_ed25519_private_key(self, use_generate_ed25519_private_key = True):
         if use_generate_ed25519_private_key:
@@ -46,6 +48,10 @@ class Assymetric_Ed25519_signing():
         return public_key
 
     def sign_and_verify_public_key(self, public_key, signature, auth_message, use_sign_and_verify_key = True):
+        if use_sign_and_verify_key and self.verification_cache is not None:
+            verifier = lambda: public_key.verify(signature, auth_message)
+            self.verification_cache.verify(public_key, signature, auth_message, "ed25519", verifier)
+            return None
         if use_sign_and_verify_key:
             sign_and_verify = public_key.verify(signature, auth_message)
         return sign_and_verify
@@ -58,6 +64,7 @@ class Assymetric_X25519PrivateKey():
         self.info                   = bytes('handshake data', encoding='utf8')
         self.algorithm              = hashes.SHA256()
         self.generate_second_key    = True
+        self.key_pool               = None  # optional crypto_utility.Ephemeral_key_pool
     
     def __str__(self):
         return self
@@ -66,6 +73,8 @@ class Assymetric_X25519PrivateKey():
         return self
 
     def generate_X25519PrivateKey(self, use_generate_private_key = True):
+        if use_generate_private_key and self.key_pool is not None:
+            return self.key_pool.acquire("x25519")
         if use_generate_private_key:
             private_key =  X25519PrivateKey.generate()
         return private_key 
@@ -92,6 +101,8 @@ class Assymetric_X25519PrivateKey():
     
     def private_key_2_for_handshake(self, use_private_key_handshake = True):
         # For the next handshake we MUST generate another private key
+        if use_private_key_handshake and self.key_pool is not None:
+            return self.key_pool.acquire("x25519")
         if use_private_key_handshake:
             private_key_2 = X25519PrivateKey.generate()
         return private_key_2
@@ -146,6 +157,44 @@ class Ed448_signing_and_verification():
             return public_key.verify(signature, data)
 
 
+# Batch EdDSA verification
+#
+# verify_many() takes (public key, signature, message) items, in the same
+# order as ECDSA_Batch_Verifier, with the public key as raw 32-byte 
+# (Ed25519) or 57-byte (Ed448) bytes or a key object, and verifies them in
+# contiguous chunks on a worker pool sized to the cores. The scheduling, the key LRU, the error rule and the stats are
+# those of crypto_utility.Batch_signature_verifier: the result is a 
+# bytearray in input order, 1 for a valid signature and 0 for any bad item.
+# `python crypto_benchmark.py eddsa_batch` measures scaling with worker count.
+#
+# Example Usage
+# verifier = EdDSA_Batch_Verifier("ed25519")
+# results = verifier.verify_many(zip(public_keys, signatures, messages))
+# print(verifier.last_batch["signatures_per_second"])
+
+EDDSA_PUBLIC_KEYS = {
+    "ed25519"   : Ed25519PublicKey,
+    "ed448"     : Ed448PublicKey,
+}
+
+def load_eddsa_public_key(encoded, algorithm):
+    return EDDSA_PUBLIC_KEYS[algorithm].from_public_bytes(encoded)
+
+def encode_eddsa_public_key(public_key, algorithm = None):
+    return public_key.public_bytes_raw()
+
+def verify_eddsa_signature(public_key, signature, message, algorithm = None):
+    public_key.verify(signature, message)
+
+class EdDSA_Batch_Verifier(Batch_signature_verifier):
+    def __init__(self, algorithm = "ed25519", workers = None, chunk_size = 512, max_keys = 65536, use_processes = False):
+        if algorithm not in EDDSA_PUBLIC_KEYS:
+            raise ValueError("unsupported EdDSA algorithm %r" % algorithm)
+        scheme = Signature_scheme(algorithm, EDDSA_PUBLIC_KEYS[algorithm], load_eddsa_public_key, encode_eddsa_public_key, verify_eddsa_signature, algorithm)
+        Batch_signature_verifier.__init__(self, scheme, workers, chunk_size, max_keys, use_processes)
+        self.algorithm = algorithm
+
+
 class X448_key_exchange():
     # For most applications the shared_key should be passed to a key derivation function. 
     # This allows mixing of additional information into the key,
@@ -0,0 +1,35 @@
+import time
+
+
+# Throughput measurement
+#
+# The timing loop and result shape shared by crypto_benchmark and the
+# hash benchmark in message_authentication. This module imports nothing
+# from the library, so both can use it without importing each other.
+#
+# Example Usage
+# operations_per_second, bytes_per_second = measure_throughput(lambda: digest(message), len(message))
+
+MESSAGE_SIZES = [64 * 4 ** exponent for exponent in range(11)]
+
+# Calls function() until min_time has passed (at least once)
+# and returns (operations per second, bytes per second).
+def measure_throughput(function, bytes_per_call, min_time = 0.2):
+    calls = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while calls == 0 or elapsed < min_time:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - started
+    return calls / elapsed, calls * bytes_per_call / elapsed
+
+def benchmark_result(benchmark, algorithm, message_size, measurement):
+    operations_per_second, bytes_per_second = measurement
+    return {
+        "benchmark"             : benchmark,
+        "algorithm"             : algorithm,
+        "message_size"          : message_size,
+        "operations_per_second" : operations_per_second,
+        "bytes_per_second"      : bytes_per_second,
+    }
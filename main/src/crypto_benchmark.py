@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import platform
+from cryptography.hazmat.primitives import cmac
+from cryptography.hazmat.primitives import hmac
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import poly1305
+from cryptography.hazmat.primitives.ciphers import algorithms
+from cryptography.hazmat.primitives.asymmetric import ec
+from elliptic_curve import EC_CURVES
+from elliptic_curve import select_curve
+from assymetric import EdDSA_Batch_Verifier
+from cryptography.hazmat.primitives.asymmetric.ed448 import Ed448PrivateKey
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from message_authentication import HASH_ALGORITHMS
+from message_authentication import benchmark_hashes
+from benchmark_measurement import MESSAGE_SIZES
+from benchmark_measurement import benchmark_result
+from benchmark_measurement import measure_throughput
+from message_authentication import Content_defined_chunker
+
+
+# Benchmarks
+#
+# Throughput numbers from the literature rarely match a given host,
+# so the library ships its own measurements.
+# Every benchmark returns a plain dict that write_results() stores as JSON,
+# together with a little information about the host it ran on.
+#
+# Example Usage
+# python crypto_benchmark.py content_chunking results.json
+# python crypto_benchmark.py hashes hashes.json
+# python crypto_benchmark.py curves
+# python crypto_benchmark.py eddsa_batch
+#
+# results = benchmark_content_chunking(size=16 * 1024 * 1024)
+# print(results["megabytes_per_second"])
+
+def host_metadata():
+    return {
+        "python"    : platform.python_version(),
+        "machine"   : platform.machine(),
+        "system"    : platform.system(),
+        "cpu_count" : os.cpu_count(),
+        "time"      : time.time(),
+    }
+
+def write_results(results, output_path = None):
+    document = {"host": host_metadata(), "results": results}
+    if output_path is None:
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(output_path, "w") as output_file:
+            json.dump(document, output_file, indent=2)
+    return document
+
+
+# Content-defined chunking
+#
+# Chunks random data (the worst case for deduplication, but a fair one for
+# the boundary scan) twice: once for boundaries only and once with chunk digests.
+# use_numpy in the result tells which boundary scan ran (see Content_defined_chunker).
+
+def benchmark_content_chunking(size = 64 * 1024 * 1024, chunker = None):
+    chunker = chunker or Content_defined_chunker()
+    data = os.urandom(size)
+
+    started = time.perf_counter()
+    chunk_count = len(chunker.chunk_lengths(memoryview(data)))
+    scan_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in chunker.chunk_bytes(data):
+        pass
+    total_seconds = time.perf_counter() - started
+
+    return {
+        "benchmark"                         : "content_chunking",
+        "bytes"                             : size,
+        "chunks"                            : chunk_count,
+        "average_chunk_size"                : size / chunk_count,
+        "algorithm"                         : chunker.algorithm,
+        "use_numpy"                         : chunker.use_numpy,
+        "scan_megabytes_per_second"         : size / scan_seconds / 1e6,
+        "megabytes_per_second"              : size / total_seconds / 1e6,
+    }
+
+
+# Hashes and MACs
+#
+# One-shot hash, HMAC, CMAC and Poly1305 over messages from 64 B to 64 MiB.
+# Every entry names its benchmark ("hash", "hmac", "cmac", "poly1305"), 
+# algorithm and message size, which is what Hash_algorithm_selector reads.
+# The hash benchmark itself lives in message_authentication, next to the
+# selector that runs it.
+
+def _one_shot_hmac(key, algorithm, message):
+    h = hmac.HMAC(key, algorithm)
+    h.update(message)
+    return h.finalize()
+
+def _one_shot_cmac(key, message):
+    c = cmac.CMAC(algorithms.AES(key))
+    c.update(message)
+    return c.finalize()
+
+def benchmark_hmacs(sizes = MESSAGE_SIZES, names = None, min_time = 0.2):
+    results = []
+    for name in names or HASH_ALGORITHMS:
+        algorithm = HASH_ALGORITHMS[name]()
+        key = os.urandom(algorithm.digest_size)
+        for size in sizes:
+            message = os.urandom(size)
+            results.append(benchmark_result("hmac", name, size, measure_throughput(lambda: _one_shot_hmac(key, algorithm, message), size, min_time)))
+    return results
+
+def benchmark_cmacs(sizes = MESSAGE_SIZES, key_sizes = (16, 32), min_time = 0.2):
+    results = []
+    for key_size in key_sizes:
+        key = os.urandom(key_size)
+        for size in sizes:
+            message = os.urandom(size)
+            results.append(benchmark_result("cmac", "aes%d" % (key_size * 8), size, measure_throughput(lambda: _one_shot_cmac(key, message), size, min_time)))
+    return results
+
+# One key for every tag: the cost of a tag does not depend on the key, so
+# this measures throughput only. Real use needs a fresh key per message.
+def benchmark_poly1305(sizes = MESSAGE_SIZES, min_time = 0.2):
+    results = []
+    key = os.urandom(32)
+    for size in sizes:
+        message = os.urandom(size)
+        results.append(benchmark_result("poly1305", "poly1305", size, measure_throughput(lambda: poly1305.Poly1305.generate_tag(key, message), size, min_time)))
+    return results
+
+def benchmark_hashes_and_macs(sizes = MESSAGE_SIZES, min_time = 0.2):
+    return benchmark_hashes(sizes, min_time=min_time) + benchmark_hmacs(sizes, min_time=min_time) + benchmark_cmacs(sizes, min_time=min_time) + benchmark_poly1305(sizes, min_time)
+
+
+# Elliptic curves
+#
+# Key generation, ECDSA sign and verify (with the curve's matching hash,
+# over a 1 KiB message) and ECDH per curve, one entry per curve and operation.
+
+def _curve_result(curve_name, operation, measurement):
+    return {
+        "benchmark"             : "ec",
+        "curve"                 : curve_name,
+        "operation"             : operation,
+        "operations_per_second" : measurement[0],
+    }
+
+def benchmark_curves(curve_names = None, min_time = 0.2):
+    results = []
+    message = os.urandom(1024)
+    for curve_name in curve_names or EC_CURVES:
+        curve, hash_algorithm = select_curve(curve_name)
+        signature_algorithm = ec.ECDSA(hash_algorithm)
+        private_key = ec.generate_private_key(curve)
+        public_key = private_key.public_key()
+        peer_public_key = ec.generate_private_key(curve).public_key()
+        signature = private_key.sign(message, signature_algorithm)
+        results.append(_curve_result(curve.name, "keygen", measure_throughput(lambda: ec.generate_private_key(curve), 0, min_time)))
+        results.append(_curve_result(curve.name, "sign", measure_throughput(lambda: private_key.sign(message, signature_algorithm), len(message), min_time)))
+        results.append(_curve_result(curve.name, "verify", measure_throughput(lambda: public_key.verify(signature, message, signature_algorithm), len(message), min_time)))
+        results.append(_curve_result(curve.name, "ecdh", measure_throughput(lambda: private_key.exchange(ec.ECDH(), peer_public_key), 0, min_time)))
+    return results
+
+
+# Batch EdDSA verification
+#
+# Verifies the same batch (signatures from `signers` keys over 256-byte 
+# messages) with 1, 2, 4, ... workers up to the core count, so the entries
+# show how verification scales with cores on this host.
+
+def benchmark_eddsa_batch(count = 20000, signers = 1000, algorithm = "ed25519", worker_counts = None, use_processes = False):
+    private_key_class = Ed25519PrivateKey if algorithm == "ed25519" else Ed448PrivateKey
+    private_keys = [private_key_class.generate() for _ in range(signers)]
+    public_keys = [private_key.public_key().public_bytes_raw() for private_key in private_keys]
+    items = []
+    for index in range(count):
+        message = os.urandom(256)
+        items.append((public_keys[index % signers], private_keys[index % signers].sign(message), message))
+    cpu_count = os.cpu_count() or 1
+    worker_counts = worker_counts or sorted({1 << exponent for exponent in range(cpu_count.bit_length()) if 1 << exponent <= cpu_count} | {cpu_count})
+    results = []
+    for workers in worker_counts:
+        verifier = EdDSA_Batch_Verifier(algorithm, workers=workers, use_processes=use_processes)
+        verifier.verify_many(items[:verifier.chunk_size * workers])  # warm up the pool and the key cache
+        verifier.verify_many(items)
+        verifier.close()
+        results.append({
+            "benchmark"             : "eddsa_batch",
+            "algorithm"             : algorithm,
+            "workers"               : workers,
+            "use_processes"         : use_processes,
+            "signatures"            : count,
+            "operations_per_second" : verifier.last_batch["signatures_per_second"],
+        })
+    return results
+
+
+BENCHMARKS = {
+    "content_chunking"  : benchmark_content_chunking,
+    "hashes"            : benchmark_hashes_and_macs,
+    "curves"            : benchmark_curves,
+    "eddsa_batch"       : benchmark_eddsa_batch,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:2] or list(BENCHMARKS)
+    output_path = sys.argv[2] if len(sys.argv) > 2 else None
+    results = []
+    for name in names:
+        result = BENCHMARKS[name]()
+        results.extend(result if isinstance(result, list) else [result])
+    write_results(results, output_path)
@@ -1,14 +1,30 @@
+import os
 import sys
+import time
+import struct
 import hashlib
+import threading
+from collections import deque
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import constant_time
 from cryptography.hazmat.primitives.asymmetric import dh
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.asymmetric.x448 import X448PrivateKey, X448PublicKey
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.asymmetric.ed448 import Ed448PublicKey
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
 from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from cryptography.hazmat.primitives.serialization import load_der_private_key
 from cryptography.hazmat.primitives.serialization import load_der_public_key
 from cryptography.hazmat.primitives.serialization import load_pem_parameters
 from cryptography.hazmat.primitives.serialization import load_der_parameters
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
 from cryptography.hazmat.primitives.asymmetric import (dsa, rsa, padding, utils)
 
 
@@ -76,11 +92,14 @@ class Asymmetric_Utilities:
         self.message         = bytes("A message I want to sign", encoding="utf8")
         self.encoding_type   = hashlib.sha256()
         self.salt_length     = padding.PSS.MAX_LENGTH
+        self.key_pool        = None  # optional rsa.RSA_Key_Pool
     
     def __repr__(self):
         return self
     
     def generate_private_key(self, use_assymetric_private_key = True):
+        if use_assymetric_private_key and self.key_pool is not None:
+            return self.key_pool.acquire(self.key_size, self.public_exponent)
         if use_assymetric_private_key:
             private_key = rsa.generate_private_key(public_exponent=self.public_exponent,key_size=self.key_size,backend=default_backend())
         return private_key
@@ -104,6 +123,694 @@ class Asymmetric_Utilities:
             return public_key.verify(signature,prehashed_msg,padding.PSS(mgf=padding.MGF1(self.encoding_type),salt_length=self.salt_length),utils.Prehashed(self.encoding_type))
 
 
+# Signature verification cache
+#
+# Verifying the same signed artifact or token again redoes the public-key 
+# operation. The cache remembers successful verifications only, under a
+# SHA-256 digest of (public key fingerprint, message digest, signature,
+# algorithm parameters), so a hit is exactly as strong as the check it replaced
+# and a failed or never-seen signature always goes to the real verifier.
+#
+# Storage is a fixed set-associative table inside bytearrays: capacity 
+# 32-byte entries plus an 8-byte key tag and a reference bit per slot,
+# evicted with a clock hand per set of `ways` slots. Memory use is fixed at
+# roughly 41 bytes per slot and never grows. invalidate_key() drops every 
+# entry of one public key, e.g. after it was revoked.
+#
+# A public key is a key object or its DER/PEM bytes (raw 32 or 57 bytes are
+# read as Ed25519 or Ed448). Either form is fingerprinted as the SHA-256 of
+# its DER SubjectPublicKeyInfo, so both share entries and key tags.
+#
+# Example Usage
+# cache = Signature_verification_cache(capacity=1 << 16)
+# cache.verify(public_key, signature, message, "ed25519", lambda: public_key.verify(signature, message))
+# print(cache.metrics())
+
+def _load_signature_public_key(encoded):
+    if encoded.startswith(b"-----"):
+        return load_pem_public_key(encoded)
+    if len(encoded) == 32:
+        return Ed25519PublicKey.from_public_bytes(encoded)
+    if len(encoded) == 57:
+        return Ed448PublicKey.from_public_bytes(encoded)
+    return load_der_public_key(encoded)
+
+class Signature_verification_cache:
+    def __init__(self, capacity = 1 << 16, ways = 8):
+        self.ways           = ways
+        self.set_count      = max(1, capacity // ways)
+        self.capacity       = self.set_count * ways
+        self.entries        = bytearray(32 * self.capacity)
+        self.key_tags       = bytearray(8 * self.capacity)
+        self.referenced     = bytearray(self.capacity)
+        self.occupied       = bytearray(self.capacity)
+        self.clock_hands    = bytearray(self.set_count)
+        self.lock           = threading.Lock()
+        self.hits           = 0
+        self.misses         = 0
+        self.insertions     = 0
+        self.evictions      = 0
+        self.invalidations  = 0
+    
+    def fingerprint(self, public_key):
+        if isinstance(public_key, (bytes, bytearray, memoryview)):
+            public_key = _load_signature_public_key(bytes(public_key))
+        return hashlib.sha256(public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)).digest()
+
+    def entry_digest(self, fingerprint, message_digest, signature, parameters):
+        h = hashlib.sha256()
+        for field in (fingerprint, message_digest, bytes(signature), parameters.encode("utf8")):
+            h.update(struct.pack(">I", len(field)))
+            h.update(field)
+        return h.digest()
+
+    def _find(self, entry, first_slot):
+        for slot in range(first_slot, first_slot + self.ways):
+            if self.occupied[slot] and self.entries[32 * slot:32 * slot + 32] == entry:
+                return slot
+        return -1
+
+    def _first_slot(self, entry):
+        return (int.from_bytes(entry[:8], "little") % self.set_count) * self.ways
+
+    def contains(self, fingerprint, message_digest, signature, parameters):
+        entry = self.entry_digest(fingerprint, message_digest, signature, parameters)
+        with self.lock:
+            slot = self._find(entry, self._first_slot(entry))
+            if slot < 0:
+                self.misses += 1
+                return False
+            self.referenced[slot] = 1
+            self.hits += 1
+            return True
+
+    def add(self, fingerprint, message_digest, signature, parameters):
+        entry = self.entry_digest(fingerprint, message_digest, signature, parameters)
+        first_slot = self._first_slot(entry)
+        set_index = first_slot // self.ways
+        with self.lock:
+            if self._find(entry, first_slot) >= 0:
+                return
+            while True:
+                slot = first_slot + self.clock_hands[set_index]
+                self.clock_hands[set_index] = (self.clock_hands[set_index] + 1) % self.ways
+                if not self.occupied[slot]:
+                    break
+                if not self.referenced[slot]:
+                    self.evictions += 1
+                    break
+                self.referenced[slot] = 0
+            self.entries[32 * slot:32 * slot + 32] = entry
+            self.key_tags[8 * slot:8 * slot + 8] = fingerprint[:8]
+            self.occupied[slot] = 1
+            self.referenced[slot] = 0
+            self.insertions += 1
+
+    # verifier() must raise (InvalidSignature) when the signature is wrong;
+    # its exception propagates and nothing is cached. message_digest can be
+    # passed when the caller already hashed the message (prehashed signing).
+    def verify(self, public_key, signature, message, parameters, verifier, message_digest = None):
+        fingerprint = self.fingerprint(public_key)
+        if message_digest is None:
+            message_digest = hashlib.sha256(message).digest()
+        if self.contains(fingerprint, message_digest, signature, parameters):
+            return True
+        verifier()
+        self.add(fingerprint, message_digest, signature, parameters)
+        return True
+
+    def invalidate_key(self, public_key):
+        tag = self.fingerprint(public_key)[:8]
+        with self.lock:
+            position = self.key_tags.find(tag)
+            while position >= 0:
+                if position % 8 == 0 and self.occupied[position // 8]:
+                    self.occupied[position // 8] = 0
+                    self.referenced[position // 8] = 0
+                    self.invalidations += 1
+                position = self.key_tags.find(tag, position + 1)
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "capacity"      : self.capacity,
+                "size"          : sum(self.occupied),
+                "hits"          : self.hits,
+                "misses"        : self.misses,
+                "insertions"    : self.insertions,
+                "evictions"     : self.evictions,
+                "invalidations" : self.invalidations,
+            }
+
+
+# Batch signature verification
+#
+# The shared core of ECDSA_Batch_Verifier (elliptic_curve.py) and
+# EdDSA_Batch_Verifier (assymetric.py). A Signature_scheme holds the only
+# per-algorithm parts: load(encoded, parameter) parses public key bytes,
+# encode(public_key, parameter) serializes a key object, and
+# verify(public_key, signature, message, parameter) raises InvalidSignature.
+# They must be module-level functions so a scheme pickles to worker processes.
+#
+# verify_many() takes (public_key, signature, message) items, the public key
+# as a key object or its encoded bytes, and verifies them in chunks of
+# chunk_size on a worker pool sized to the cores; with group_by_key a chunk
+# only holds items of one public key. Encoded keys are parsed once and kept
+# in the verifier's own LRU of max_keys loaded key objects.
+#
+# The result is a bytearray in input order, 1 for a valid signature and 0
+# for any bad item: a wrong signature, a malformed key or a key of another
+# type, a signature or message that is not bytes-like. It never raises for
+# a bad item. last_batch holds the throughput of the most recent call.
+#
+# Threads are the default. use_processes=True runs the chunks in worker
+# processes instead, for builds of cryptography that hold the GIL while
+# verifying; keys then travel encoded and each worker process keeps its own
+# LRU for the verifier.
+
+BATCH_ITEM_ERRORS = (InvalidSignature, UnsupportedAlgorithm, ValueError, TypeError)
+
+class Signature_scheme:
+    def __init__(self, name, key_type, load, encode, verify, parameter = None):
+        self.name       = name
+        self.key_type   = key_type
+        self.load       = load
+        self.encode     = encode
+        self.verify     = verify
+        self.parameter  = parameter
+
+# In a worker process, the LRU of each verifier by its token.
+_process_public_key_caches = {}
+
+def _process_public_key_cache(token, max_keys):
+    cache = _process_public_key_caches.get(token)
+    if cache is None:
+        cache = _process_public_key_caches[token] = Batch_public_key_cache(max_keys, token)
+    return cache
+
+# LRU of loaded public keys for one verifier. A copy sent to a worker 
+# process unpickles as that process's own cache with the same token.
+class Batch_public_key_cache:
+    def __init__(self, max_keys = 1024, token = None):
+        self.max_keys   = max_keys
+        self.token      = token or os.urandom(16)
+        self.keys       = OrderedDict()
+        self.lock       = threading.Lock()
+
+    def __reduce__(self):
+        return _process_public_key_cache, (self.token, self.max_keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def load(self, scheme, public_key):
+        if not isinstance(public_key, bytes):
+            return public_key
+        with self.lock:
+            loaded = self.keys.get(public_key)
+            if loaded is not None:
+                self.keys.move_to_end(public_key)
+                return loaded
+        loaded = scheme.load(public_key, scheme.parameter)
+        with self.lock:
+            self.keys[public_key] = loaded
+            while len(self.keys) > self.max_keys:
+                self.keys.popitem(last=False)
+        return loaded
+
+# Returns 1/0 per item; consecutive items with the same key share one lookup.
+def verify_signature_chunk(scheme, key_cache, public_keys, signatures, messages):
+    results = bytearray(len(signatures))
+    last_key = loaded = None
+    for index, (public_key, signature, message) in enumerate(zip(public_keys, signatures, messages)):
+        try:
+            if public_key is None:
+                continue
+            if public_key is not last_key:
+                loaded = key_cache.load(scheme, public_key)
+                last_key = public_key
+            if isinstance(loaded, scheme.key_type):
+                scheme.verify(loaded, signature, message, scheme.parameter)
+                results[index] = 1
+        except BATCH_ITEM_ERRORS:
+            pass
+    return results
+
+def _batch_bytes(data):
+    if isinstance(data, (bytearray, memoryview)):
+        return bytes(data)
+    return data
+
+class Batch_signature_verifier:
+    def __init__(self, scheme, workers = None, chunk_size = 256, max_keys = 1024, use_processes = False, group_by_key = False):
+        self.scheme         = scheme
+        self.workers        = workers or os.cpu_count() or 1
+        self.chunk_size     = chunk_size
+        self.max_keys       = max_keys
+        self.key_cache      = Batch_public_key_cache(max_keys)
+        self.use_processes  = use_processes
+        self.group_by_key   = group_by_key
+        self.executor       = (ProcessPoolExecutor if use_processes else ThreadPoolExecutor)(max_workers=self.workers)
+        self.last_batch     = None
+        self.verified       = 0
+        self.failed         = 0
+
+    # Encoded bytes of a public key, or None if it cannot be encoded.
+    def _encode(self, public_key):
+        if isinstance(public_key, (bytes, bytearray, memoryview)):
+            return bytes(public_key)
+        try:
+            return self.scheme.encode(public_key, self.scheme.parameter)
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    # Processes get encoded keys; threads keep key objects.
+    def _worker_key(self, public_key):
+        if self.use_processes or isinstance(public_key, (bytearray, memoryview)):
+            return self._encode(public_key)
+        return public_key
+
+    def _submit(self, public_keys, signatures, messages):
+        return self.executor.submit(verify_signature_chunk, self.scheme, self.key_cache, public_keys, signatures, messages)
+
+    def verify_many(self, items):
+        started = time.perf_counter()
+        public_keys, signatures, messages = [], [], []
+        for public_key, signature, message in items:
+            public_keys.append(public_key)
+            signatures.append(_batch_bytes(signature))
+            messages.append(_batch_bytes(message))
+        count = len(signatures)
+        chunks = []
+        if self.group_by_key:
+            # Key objects are grouped by their encoding: equal keys from
+            # different objects share a group and the first object is used.
+            groups = OrderedDict()
+            for index, public_key in enumerate(public_keys):
+                group_key = self._encode(public_key)
+                group = groups.get(group_key)
+                if group is None:
+                    group = groups[group_key] = (self._worker_key(public_key) if group_key is not None else None, [])
+                group[1].append(index)
+            for worker_key, indexes in groups.values():
+                for offset in range(0, len(indexes), self.chunk_size):
+                    chunk = indexes[offset:offset + self.chunk_size]
+                    chunks.append((chunk, self._submit([worker_key] * len(chunk), [signatures[index] for index in chunk], [messages[index] for index in chunk])))
+        else:
+            public_keys = [self._worker_key(public_key) for public_key in public_keys]
+            for offset in range(0, count, self.chunk_size):
+                end = offset + self.chunk_size
+                chunks.append((range(offset, min(end, count)), self._submit(public_keys[offset:end], signatures[offset:end], messages[offset:end])))
+        results = bytearray(count)
+        for indexes, future in chunks:
+            if isinstance(indexes, range):
+                results[indexes.start:indexes.stop] = future.result()
+                continue
+            for index, valid in zip(indexes, future.result()):
+                results[index] = valid
+        elapsed = time.perf_counter() - started
+        valid = sum(results)
+        self.verified += valid
+        self.failed += count - valid
+        self.last_batch = {
+            "signatures"            : count,
+            "valid"                 : valid,
+            "chunks"                : len(chunks),
+            "workers"               : self.workers,
+            "seconds"               : elapsed,
+            "signatures_per_second" : count / elapsed if elapsed > 0 else 0.0,
+        }
+        if self.group_by_key:
+            self.last_batch["public_keys"] = len(groups)
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+# Ephemeral key pool
+#
+# Every ECDHE/DHE handshake needs a fresh private key, and generating it 
+# inline puts key generation on the critical path of the handshake. The pool
+# keeps up to `depth` ready key pairs per group and a background thread 
+# tops a group up again once it drops to low_watermark, so a burst of 
+# connections is served from keys generated while the service was idle.
+# An empty pool never blocks: the key is generated inline and counted as a miss.
+#
+# Groups are named: "x25519", "x448", the EPHEMERAL_CURVES names
+# and the DH_STANDARD_GROUPS names ("ffdhe2048", "modp3072", ...). The
+# diffie_hellman module is only imported once a DH group is asked for.
+#
+# Keys are handed out wrapped in One_time_ephemeral_key, which allows a
+# single exchange() and then drops its only reference to the private key,
+# so OpenSSL frees (and cleanses) it. Python cannot overwrite the key 
+# material itself; dropping every reference is as close as it gets.
+#
+# Example Usage
+# pool = Ephemeral_key_pool(groups=("x25519", "secp384r1"), depth=128)
+# exchange = ECDHE_key_Exchange_Ephemeral_Form()
+# exchange.key_pool = pool
+# private_key = exchange.generate_private_key()
+# shared_key = private_key.exchange(ec.ECDH(), peer_public_key)
+
+EPHEMERAL_CURVES = {
+    "secp256r1" : ec.SECP256R1,
+    "secp384r1" : ec.SECP384R1,
+    "secp521r1" : ec.SECP521R1,
+    "secp256k1" : ec.SECP256K1,
+}
+
+def generate_ephemeral_private_key(group):
+    if group == "x25519":
+        return X25519PrivateKey.generate()
+    if group == "x448":
+        return X448PrivateKey.generate()
+    if group in EPHEMERAL_CURVES:
+        return ec.generate_private_key(EPHEMERAL_CURVES[group]())
+    if _is_dh_standard_group(group):
+        from diffie_hellman import standard_group_parameters
+        return standard_group_parameters(group).generate_private_key()
+    raise ValueError("unknown ephemeral key group %r" % group)
+
+def _is_dh_standard_group(group):
+    from diffie_hellman import DH_STANDARD_GROUPS
+    return group in DH_STANDARD_GROUPS
+
+class One_time_ephemeral_key:
+    def __init__(self, private_key, group):
+        self.group          = group
+        self.private_key    = private_key
+        self.public         = private_key.public_key()
+        self.lock           = threading.Lock()
+    
+    def public_key(self):
+        return self.public
+
+    @property
+    def used(self):
+        return self.private_key is None
+
+    # Same arguments as the wrapped key's exchange(); works exactly once.
+    def exchange(self, *arguments):
+        with self.lock:
+            private_key, self.private_key = self.private_key, None
+        if private_key is None:
+            raise ValueError("ephemeral %s key was already used" % self.group)
+        return private_key.exchange(*arguments)
+
+    def destroy(self):
+        with self.lock:
+            self.private_key = None
+
+class Ephemeral_key_pool:
+    def __init__(self, groups = ("x25519",), depth = 64, low_watermark = None):
+        low_watermark = depth // 2 if low_watermark is None else low_watermark
+        if not 0 <= low_watermark < depth:
+            raise ValueError("low_watermark must be smaller than depth")
+        for group in groups:
+            if not self._known_group(group):
+                raise ValueError("unknown ephemeral key group %r" % group)
+        self.depth          = depth
+        self.low_watermark  = low_watermark
+        self.keys           = {group: deque() for group in groups}
+        self.condition      = threading.Condition()
+        self.generated      = 0
+        self.handed_out     = 0
+        self.misses         = 0
+        self.closed         = False
+        self.worker         = threading.Thread(target=self._refill_loop, name="ephemeral-key-pool", daemon=True)
+        self.worker.start()
+    
+    @staticmethod
+    def _known_group(group):
+        return group in ("x25519", "x448") or group in EPHEMERAL_CURVES or _is_dh_standard_group(group)
+
+    def _low_group(self):
+        for group, keys in self.keys.items():
+            if len(keys) <= self.low_watermark:
+                return group
+        return None
+
+    # Fills one group at a time back up to depth; the lock is only held to
+    # append, so acquire() never waits for a key to be generated.
+    def _refill_loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or self._low_group() is not None)
+                if self.closed:
+                    return
+                group = self._low_group()
+            while True:
+                key = One_time_ephemeral_key(generate_ephemeral_private_key(group), group)
+                with self.condition:
+                    if self.closed:
+                        key.destroy()
+                        return
+                    self.keys[group].append(key)
+                    self.generated += 1
+                    if len(self.keys[group]) >= self.depth:
+                        break
+
+    def acquire(self, group = "x25519"):
+        if not self._known_group(group):
+            raise ValueError("unknown ephemeral key group %r" % group)
+        with self.condition:
+            keys = self.keys.setdefault(group, deque())
+            key = keys.popleft() if keys else None
+            if key is None:
+                self.misses += 1
+            else:
+                self.handed_out += 1
+            if len(keys) <= self.low_watermark:
+                self.condition.notify_all()
+        if key is None:
+            key = One_time_ephemeral_key(generate_ephemeral_private_key(group), group)
+        return key
+
+    def metrics(self):
+        with self.condition:
+            return {
+                "depth"         : {group: len(keys) for group, keys in self.keys.items()},
+                "generated"     : self.generated,
+                "handed_out"    : self.handed_out,
+                "misses"        : self.misses,
+            }
+
+    # Stops the refill thread and destroys every key still in the pool.
+    def close(self):
+        with self.condition:
+            self.closed = True
+            for keys in self.keys.values():
+                for key in keys:
+                    key.destroy()
+                keys.clear()
+            self.condition.notify_all()
+        self.worker.join()
+
+
+# Peer public key registry
+#
+# A broker that talks to thousands of long-lived peers decodes and 
+# validates the same encoded public keys, and repeats the same static ECDH
+# scalar multiplication, on every exchange. The registry caches both:
+#
+#   - decoded, validated public key objects by SHA-256 fingerprint of 
+#     the encoding they arrived in (raw X25519/X448 keys, X9.62 points with
+#     a curve name, or DER/PEM SubjectPublicKeyInfo);
+#   - the shared secret and the HKDF-derived key per (local key, peer key).
+#
+# Secrets are keyed by a canonical fingerprint (curve name plus raw key or
+# uncompressed point), so one peer presented as DER, as a point or as a
+# key object shares a single cached secret.
+#
+# Both tables are LRU bounded by entry count, and by max_bytes of 
+# estimated memory across both of them. invalidate_peer() drops a peer's
+# key and every secret derived with it, e.g. after it rotated its key.
+#
+# Only use this for static keys: caching a secret of an ephemeral exchange
+# keeps it alive and gives up forward secrecy.
+#
+# Example Usage
+# registry = Peer_public_key_registry(max_bytes=64 * 1024 * 1024)
+# key = registry.derived_key(broker_private_key, peer_key_bytes, curve="secp256r1")
+# print(registry.metrics())
+
+PEER_KEY_OVERHEAD       = 512   # estimated bytes for a decoded key object and its table slot
+PEER_SECRET_OVERHEAD    = 256   # estimated bytes for a cached secret's table slot
+
+# Returns (encoding, curve name) in the form decode_peer_public_key reads.
+def _canonical_public_key(public_key):
+    if isinstance(public_key, X25519PublicKey):
+        return public_key.public_bytes(Encoding.Raw, PublicFormat.Raw), "x25519"
+    if isinstance(public_key, X448PublicKey):
+        return public_key.public_bytes(Encoding.Raw, PublicFormat.Raw), "x448"
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return public_key.public_bytes(Encoding.X962, PublicFormat.UncompressedPoint), public_key.curve.name
+    return public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo), None
+
+def decode_peer_public_key(encoded, curve = None):
+    if encoded.startswith(b"-----"):
+        return load_pem_public_key(encoded)
+    if curve is not None:
+        if curve == "x25519":
+            return X25519PublicKey.from_public_bytes(encoded)
+        if curve == "x448":
+            return X448PublicKey.from_public_bytes(encoded)
+        if curve not in EPHEMERAL_CURVES:
+            raise ValueError("unknown curve %r" % curve)
+        return ec.EllipticCurvePublicKey.from_encoded_point(EPHEMERAL_CURVES[curve](), encoded)
+    return load_der_public_key(encoded)
+
+class Peer_public_key_registry:
+    def __init__(self, max_keys = 4096, max_secrets = 4096, max_bytes = None, hash_algorithm = None, key_length = 32, info = b"handshake data"):
+        self.max_keys       = max_keys
+        self.max_secrets    = max_secrets
+        self.max_bytes      = max_bytes
+        self.hash_algorithm = hash_algorithm or hashes.SHA256()
+        self.key_length     = key_length
+        self.info           = info
+        self.keys           = OrderedDict()     # encoding fingerprint -> (canonical fingerprint, public key, size)
+        self.secrets        = OrderedDict()     # (local, peer fingerprint) -> [shared secret, derived key, size]
+        self.peer_secrets   = {}                # peer fingerprint -> set of secret slots
+        self.local_keys     = {}                # id(local private key) -> (key, fingerprint)
+        self.memory_bytes   = 0
+        self.lock           = threading.Lock()
+        self.key_hits       = 0
+        self.key_misses     = 0
+        self.secret_hits    = 0
+        self.secret_misses  = 0
+        self.evictions      = 0
+    
+    @staticmethod
+    def fingerprint(encoded, curve = None):
+        return hashlib.sha256((curve or "").encode("utf8") + b"\0" + bytes(encoded)).digest()
+
+    def canonical_fingerprint(self, public_key):
+        return self.fingerprint(*_canonical_public_key(public_key))
+
+    # Returns (canonical fingerprint, public key), decoding and validating 
+    # an encoding only the first time it is seen. Key objects are used as given.
+    def public_key(self, encoded, curve = None):
+        if not isinstance(encoded, (bytes, bytearray, memoryview)):
+            return self.canonical_fingerprint(encoded), encoded
+        encoded = bytes(encoded)
+        fingerprint = self.fingerprint(encoded, curve)
+        with self.lock:
+            entry = self.keys.get(fingerprint)
+            if entry is not None:
+                self.keys.move_to_end(fingerprint)
+                self.key_hits += 1
+                return entry[0], entry[1]
+            self.key_misses += 1
+        public_key = decode_peer_public_key(encoded, curve)
+        canonical = self.canonical_fingerprint(public_key)
+        size = PEER_KEY_OVERHEAD + len(encoded)
+        with self.lock:
+            if fingerprint not in self.keys:
+                self.keys[fingerprint] = (canonical, public_key, size)
+                self.memory_bytes += size
+                self._evict()
+        return canonical, public_key
+
+    # Local keys are few and long-lived; their fingerprints are kept by 
+    # object, holding a reference so the id cannot be reused.
+    def _local_fingerprint(self, local_private_key):
+        entry = self.local_keys.get(id(local_private_key))
+        if entry is None or entry[0] is not local_private_key:
+            entry = (local_private_key, self.canonical_fingerprint(local_private_key.public_key()))
+            with self.lock:
+                if len(self.local_keys) >= 64:
+                    self.local_keys.clear()
+                self.local_keys[id(local_private_key)] = entry
+        return entry[1]
+
+    def _secret_entry(self, local_private_key, encoded, curve):
+        peer_fingerprint, peer_public_key = self.public_key(encoded, curve)
+        slot = (self._local_fingerprint(local_private_key), peer_fingerprint)
+        with self.lock:
+            entry = self.secrets.get(slot)
+            if entry is not None:
+                self.secrets.move_to_end(slot)
+                self.secret_hits += 1
+                return slot, entry
+            self.secret_misses += 1
+        if isinstance(local_private_key, ec.EllipticCurvePrivateKey):
+            shared_key = local_private_key.exchange(ec.ECDH(), peer_public_key)
+        else:
+            shared_key = local_private_key.exchange(peer_public_key)
+        with self.lock:
+            entry = self.secrets.get(slot)
+            if entry is None:
+                entry = self.secrets[slot] = [shared_key, None, PEER_SECRET_OVERHEAD + len(shared_key)]
+                self.peer_secrets.setdefault(peer_fingerprint, set()).add(slot)
+                self.memory_bytes += entry[2]
+                self._evict()
+        return slot, entry
+
+    def shared_key(self, local_private_key, encoded, curve = None):
+        return self._secret_entry(local_private_key, encoded, curve)[1][0]
+
+    def derived_key(self, local_private_key, encoded, curve = None):
+        slot, entry = self._secret_entry(local_private_key, encoded, curve)
+        derived_key = entry[1]
+        if derived_key is None:
+            derived_key = HKDF(algorithm=self.hash_algorithm, length=self.key_length, salt=None, info=self.info).derive(entry[0])
+            with self.lock:
+                if entry[1] is None and slot in self.secrets:
+                    entry[1] = derived_key
+                    entry[2] += len(derived_key)
+                    self.memory_bytes += len(derived_key)
+        return derived_key
+
+    def _drop_secret(self, slot):
+        entry = self.secrets.pop(slot)
+        self.memory_bytes -= entry[2]
+        slots = self.peer_secrets.get(slot[1])
+        if slots is not None:
+            slots.discard(slot)
+            if not slots:
+                del self.peer_secrets[slot[1]]
+
+    # Caller holds the lock. Over max_bytes decoded keys go first: they are 
+    # larger and cheaper to rebuild than a secret (a decode, not a scalar 
+    # multiplication), and a cached secret does not need its peer key.
+    def _evict(self):
+        while len(self.secrets) > self.max_secrets:
+            self._drop_secret(next(iter(self.secrets)))
+            self.evictions += 1
+        while len(self.keys) > self.max_keys:
+            self.memory_bytes -= self.keys.popitem(last=False)[1][2]
+            self.evictions += 1
+        while self.max_bytes is not None and self.memory_bytes > self.max_bytes and (self.secrets or self.keys):
+            if self.keys:
+                self.memory_bytes -= self.keys.popitem(last=False)[1][2]
+            else:
+                self._drop_secret(next(iter(self.secrets)))
+            self.evictions += 1
+
+    # Drops every cached encoding of the peer's key and every secret derived with it.
+    def invalidate_peer(self, encoded, curve = None):
+        canonical, _ = self.public_key(encoded, curve)
+        with self.lock:
+            for fingerprint in [fingerprint for fingerprint, entry in self.keys.items() if entry[0] == canonical]:
+                self.memory_bytes -= self.keys.pop(fingerprint)[2]
+            for slot in list(self.peer_secrets.get(canonical, ())):
+                self._drop_secret(slot)
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "keys"          : len(self.keys),
+                "secrets"       : len(self.secrets),
+                "memory_bytes"  : self.memory_bytes,
+                "key_hits"      : self.key_hits,
+                "key_misses"    : self.key_misses,
+                "secret_hits"   : self.secret_hits,
+                "secret_misses" : self.secret_misses,
+                "evictions"     : self.evictions,
+            }
+
+
 # Constant time functions
 #
 # This module contains functions for operating with secret data 
@@ -1,7 +1,145 @@
+import os
+import threading
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import dh
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
+from parameter_store import Parameter_store
+
+
+# Standard groups
+#
+# Generating DH parameters takes seconds to minutes, so by default both
+# classes use the RFC 7919 group of their key_size (ffdhe2048 for the 
+# default 2048 bits); set group_name to pick another group. The primes are not stored as hex blobs; they
+# are rebuilt from the formulas in RFC 3526 (MODP, based on pi) and 
+# RFC 7919 (ffdhe, based on e) on first use and kept in memory:
+#
+#   p = 2^b - 2^(b-64) + ([2^(b-130) * constant] + offset) * 2^64 - 1
+#
+# All of them are safe primes with generator 2. RFC 7919 groups also carry
+# q = (p - 1) / 2, which lets the backend check peer public keys.
+#
+# Example Usage
+# parameters = standard_group_parameters("ffdhe3072")
+# private_key = parameters.generate_private_key()
+
+DH_STANDARD_GROUPS = {
+    "modp2048"  : (2048, "pi", 124476),
+    "modp3072"  : (3072, "pi", 1690314),
+    "modp4096"  : (4096, "pi", 240904),
+    "modp6144"  : (6144, "pi", 929484),
+    "modp8192"  : (8192, "pi", 4743158),
+    "ffdhe2048" : (2048, "e", 560316),
+    "ffdhe3072" : (3072, "e", 2625351),
+    "ffdhe4096" : (4096, "e", 5736041),
+    "ffdhe6144" : (6144, "e", 15705020),
+    "ffdhe8192" : (8192, "e", 10965728),
+}
+
+_standard_groups = {}
+_standard_groups_lock = threading.Lock()
+
+def _arctan_inverse(x, scale):
+    total = term = scale // x
+    x_squared = x * x
+    k = 1
+    while term:
+        term //= x_squared
+        total += (-term if k & 1 else term) // (2 * k + 1)
+        k += 1
+    return total
+
+# floor(2^bits * pi) and floor(2^bits * e), with guard bits for the truncated series.
+def _scaled_constant(constant, bits, guard_bits = 32):
+    scale = 1 << (bits + guard_bits)
+    if constant == "pi":
+        value = 16 * _arctan_inverse(5, scale) - 4 * _arctan_inverse(239, scale)
+    else:
+        value, term, k = 0, scale, 0
+        while term:
+            value += term
+            k += 1
+            term //= k
+    return value >> guard_bits
+
+def standard_group_prime(name):
+    bits, constant, offset = DH_STANDARD_GROUPS[name]
+    return (1 << bits) - (1 << (bits - 64)) + ((_scaled_constant(constant, bits - 130) + offset) << 64) - 1
+
+def standard_group_parameters(name):
+    if name not in DH_STANDARD_GROUPS:
+        raise ValueError("unknown DH group %r, expected one of %s" % (name, ", ".join(DH_STANDARD_GROUPS)))
+    parameters = _standard_groups.get(name)
+    if parameters is None:
+        with _standard_groups_lock:
+            parameters = _standard_groups.get(name)
+            if parameters is None:
+                p = standard_group_prime(name)
+                q = (p - 1) // 2 if name.startswith("ffdhe") else None
+                parameters = dh.DHParameterNumbers(p, 2, q).parameters()
+                _standard_groups[name] = parameters
+    return parameters
+
+
+# Parameter cache
+#
+# Custom parameters are generated once and persisted by the shared 
+# parameter_store.Parameter_store (JSON numbers, atomic fsynced writes).
+# Caches written by earlier versions as PKCS#3 PEM are still read. Names 
+# from DH_STANDARD_GROUPS are served from memory and never touch the disk.
+#
+# Example Usage
+# cache = DH_Parameter_Cache("/var/lib/app/dh")
+# exchange = Diffie_Hellman_key_exchange_Ephemeral_Form()
+# exchange.group_name = "internal-3072"
+# exchange.key_size = 3072
+# exchange.parameter_cache = cache
+
+class DH_Parameter_Cache(Parameter_store):
+    algorithm = "dh"
+
+    def parameter_numbers(self, parameters):
+        numbers = parameters.parameter_numbers()
+        return numbers.p, numbers.q, numbers.g
+
+    def parameters_from_numbers(self, p, q, g):
+        return dh.DHParameterNumbers(p, g, q).parameters()
+
+    def generate_parameters(self, key_size, generator = 2):
+        return dh.generate_parameters(generator=generator, key_size=key_size)
+
+    def get_parameters(self, name = "default", key_size = 2048, generator = 2):
+        if name in DH_STANDARD_GROUPS:
+            return standard_group_parameters(name)
+        return Parameter_store.get_parameters(self, name, key_size, generator=generator)
+
+    def load_parameters(self, name):
+        parameters = Parameter_store.load_parameters(self, name)
+        if parameters is None:
+            try:
+                with open(os.path.join(self.directory, "%s.pem" % name), "rb") as parameter_file:
+                    return serialization.load_pem_parameters(parameter_file.read())
+            except FileNotFoundError:
+                return None
+        return parameters
+
+# The RFC 7919 group of key_size bits, or None if there is none.
+def default_group_name(key_size):
+    group_name = "ffdhe%d" % key_size
+    return group_name if group_name in DH_STANDARD_GROUPS else None
+
+# Named group first, then the cache, and only then fresh (slow) generation.
+# Without a group name the ffdhe group of key_size is used when one exists;
+# an explicit group name decides the size by itself.
+def load_parameters(group_name, parameter_cache = None, key_size = 2048, generator = 2):
+    group_name = group_name or default_group_name(key_size)
+    if parameter_cache is not None:
+        return parameter_cache.get_parameters(group_name or "default-%d" % key_size, key_size, generator)
+    if group_name is not None:
+        return standard_group_parameters(group_name)
+    return dh.generate_parameters(generator=generator, key_size=key_size)
 
 
 # For security and performance reasons we suggest using ECDH instead of DH where possible.
@@ -20,21 +158,23 @@ class Diffie_Hellman_key_exchange:
         self.key_length  = int('32')
         self.algorithm_type = hashes.SHA256()
         self.handshake_data = bytes('handshake data', encoding="utf8")
+        self.group_name = None          # a DH_STANDARD_GROUPS name; None means "ffdhe<key_size>", or generated parameters for other sizes
+        self.parameter_cache = None     # optional DH_Parameter_Cache
     
     def __repr__(self):
         return self
     
     # Generate some parameters. These can be reused.
-    def generate_parameter(self, generate_cipher_parameter True):
+    def generate_parameter(self, generate_cipher_parameter = True):
         if generate_cipher_parameter:
-            parameters = dh.generate_parameters(generator=self.generator, key_size=self.key_size)
+            parameters = load_parameters(self.group_name, self.parameter_cache, self.key_size, self.generator)
         return parameters
     
     # Generate a private key for use in the exchange.
     def generate_server_private_key(self, parameters, generate_private_key = True):
         if generate_private_key:
             server_private_key = parameters.generate_private_key()
-        reutrn server_private_key
+        return server_private_key
     
     def generate_peer_private_key(self, parameters, use_peer_private_key = True):
         if use_peer_private_key:
@@ -82,7 +222,10 @@ class Diffie_Hellman_key_exchange_Ephemeral_Form:
         self.generator = int('2')
         self.key_length = int('32')
         self.algorithm_type = hashes.SHA256()
-        self.handshake_data = bytes('handshake data')
+        self.handshake_data = bytes('handshake data', encoding="utf8")
+        self.group_name = None          # a DH_STANDARD_GROUPS name; None means "ffdhe<key_size>", or generated parameters for other sizes
+        self.parameter_cache = None     # optional DH_Parameter_Cache
+        self.key_pool = None            # optional crypto_utility.Ephemeral_key_pool
     
     def __repr__(self):
         return self
@@ -90,13 +233,17 @@ class Diffie_Hellman_key_exchange_Ephemeral_Form:
     # Generate some parameters. These can be reused.
     def generate_parameters(self, use_parameters = True):
         if use_parameters:
-            parameters = dh.generate_parameters(generator=self.generator, key_size=self.key_size)
+            parameters = load_parameters(self.group_name, self.parameter_cache, self.key_size, self.generator)
         return parameters
     
     # Generate a public key for use in the exchange.
 
 
     def generate_private_key(self, parameters, use_private_key = True):
+        # Pooled keys only exist for the standard groups.
+        group_name = self.group_name or default_group_name(self.key_size)
+        if use_private_key and self.key_pool is not None and group_name in DH_STANDARD_GROUPS and parameters is standard_group_parameters(group_name):
+            return self.key_pool.acquire(group_name)
         if use_private_key:
             private_key = parameters.generate_private_key()
         return private_key
@@ -1,6 +1,14 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import dsa
 from cryptography.hazmat.primitives.asymmetric import utils
+from parameter_store import Parameter_store
 
 
 
@@ -14,16 +22,28 @@ class DSA_Algoirthm:
         self.key_size = int('1024')
         self.data     = bytes("this is some data I'd like to sign", encoding="utf8")
         self.hash_algorithm = hashes.SHA256()
+        self.verification_cache = None  # optional crypto_utility.Signature_verification_cache
+        self.parameters = None          # optional shared DSAParameters, see DSA_Parameter_Store
     
     def __repr__(self):
         return self
     
     # Generate Private Key
+    # Without shared parameters every key gets brand-new domain parameters,
+    # which is by far the slowest part of DSA key generation.
     def generate_privte_key(self, use_private_key = True):
+        if use_private_key and self.parameters is not None:
+            return self.parameters.generate_private_key()
         if use_private_key:
             private_key = dsa.generate_private_key(key_size=self.key_size,)
         return private_key
     
+    # Bulk key generation from the shared parameters on a process pool.
+    def generate_keys(self, count, workers = None):
+        if self.parameters is None:
+            self.parameters = dsa.generate_parameters(key_size=self.key_size)
+        return generate_dsa_keys(self.parameters, count, workers)
+    
     # Generate Public Key
     def generate_public_key(self, private_key, use_public_key = True):
         if use_public_key:
@@ -42,24 +62,203 @@ class DSA_Algoirthm:
             chosen_hash = self.hash_algorithm
             hasher = hashes.Hash(chosen_hash)
             hasher.update(data)
-            hasher.update(data)
             digest = hasher.finalize()
             sig = private_key.sign(digest,utils.Prehashed(chosen_hash))
         return sig
     
     # Verification
     def data_verification(self, public_key, signature, data, use_verification = True):
-        if use_verification:
+        if use_verification and self.verification_cache is not None:
+            verifier = lambda: public_key.verify(signature, data, self.hash_algorithm)
+            self.verification_cache.verify(public_key, signature, data, "dsa/" + self.hash_algorithm.name, verifier)
+        elif use_verification:
             public_key.verify(signature, data, self.hash_algorithm)
         return public_key
     
 
-    def verify_big_data(self, signature, data, use_verify_big_data = True):
+    def verify_big_data(self, public_key, signature, data, use_verify_big_data = True):
         if use_verify_big_data:
             chosen_hash = self.hash_algorithm
             hasher = hashes.Hash(chosen_hash)
             hasher.update(data)
-            hasher.update(data)
             digest = hasher.finalize()
             public_key.verify(signature, digest, utils.Prehashed(chosen_hash))
         return public_key
+
+
+# Shared DSA domain parameters
+#
+# Generating (p, q, g) is orders of magnitude slower than generating a key
+# from existing parameters, and parameters can be shared by any number of keys. 
+# The store generates each named parameter set once, persists its numbers
+# with the shared parameter_store.Parameter_store (JSON, atomic fsynced
+# writes) and loads them from there on the next start.
+#
+# Example Usage
+# store = DSA_Parameter_Store("/var/lib/pycrypt/dsa")
+# signer = DSA_Algoirthm()
+# signer.parameters = store.get_parameters("partner", key_size=2048)
+# private_keys = signer.generate_keys(5000)
+
+class DSA_Parameter_Store(Parameter_store):
+    algorithm = "dsa"
+
+    def parameter_numbers(self, parameters):
+        numbers = parameters.parameter_numbers()
+        return numbers.p, numbers.q, numbers.g
+
+    def parameters_from_numbers(self, p, q, g):
+        return dsa.DSAParameterNumbers(p=p, q=q, g=g).parameters()
+
+    def generate_parameters(self, key_size):
+        return dsa.generate_parameters(key_size=key_size)
+
+
+# Keys cross the process boundary as PKCS8 DER; parameter numbers are plain ints.
+def generate_dsa_keys_der(p, q, g, count):
+    parameters = dsa.DSAParameterNumbers(p=p, q=q, g=g).parameters()
+    return [parameters.generate_private_key().private_bytes(encoding=serialization.Encoding.DER, format=serialization.PrivateFormat.PKCS8, encryption_algorithm=serialization.NoEncryption()) for _ in range(count)]
+
+def generate_dsa_keys(parameters, count, workers = None):
+    numbers = parameters.parameter_numbers()
+    workers = workers or os.cpu_count() or 1
+    slice_size = max(1, -(-count // (workers * 4)))
+    private_keys = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_dsa_keys_der, numbers.p, numbers.q, numbers.g, min(slice_size, count - offset)) for offset in range(0, count, slice_size)]
+        for future in futures:
+            private_keys.extend(serialization.load_der_private_key(der, password=None) for der in future.result())
+    return private_keys
+
+
+# Signed multi-file manifests
+#
+# Signing every file of a release separately costs one DSA operation per file.
+# The manifest signer hashes all files in parallel on a thread pool (hashlib
+# releases the GIL), writes one canonical manifest line per file, sorted by 
+# path, and signs only the digest of the manifest.
+#
+#   pycrypt-manifest-1 sha256
+#   <hex digest> <size> <path relative to root, "/" separated>
+#
+# The size is the number of bytes that were hashed, not a separate stat,
+# so a file that changes while it is read never gets a size and digest 
+# from two different versions.
+#
+# Verification checks the one signature first, then compares sizes (a 
+# quick stat) and re-hashes the files in parallel, checking digest and 
+# hashed size, stopping at the first mismatch. Files 
+# added to the directory after signing are ignored unless strict=True, 
+# which also requires the directory to hold exactly the manifest's files.
+#
+# Example Usage
+# signer = DSA_Manifest_Signer()
+# manifest, signature = signer.sign_directory(private_key, "release/")
+# signer.verify_directory(public_key, "release/", manifest, signature)
+# signer.verify_directory(public_key, "release/", manifest, signature, strict=True)
+
+MANIFEST_HEADER = "pycrypt-manifest-1"
+
+class DSA_Manifest_Signer:
+    def __init__(self, hash_name = "sha256", max_workers = None, buffer_size = 1024 * 1024):
+        self.hash_name      = hash_name
+        self.max_workers    = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        self.buffer_size    = buffer_size
+        self.thread_buffers = threading.local()
+        self.signing_hash   = hashes.SHA256()
+        hashlib.new(hash_name)
+    
+    def list_files(self, root_directory):
+        paths = []
+        for directory, directory_names, file_names in os.walk(root_directory):
+            directory_names.sort()
+            for file_name in file_names:
+                full_path = os.path.join(directory, file_name)
+                if os.path.isfile(full_path) and not os.path.islink(full_path):
+                    paths.append(os.path.relpath(full_path, root_directory).replace(os.sep, "/"))
+        return sorted(paths)
+
+    # Returns (hex digest, size) with the size counted from the bytes that
+    # were hashed, or None when stop is set before the file was fully read.
+    def file_digest(self, full_path, stop = None):
+        buffer = getattr(self.thread_buffers, "buffer", None)
+        if buffer is None:
+            buffer = self.thread_buffers.buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        h = hashlib.new(self.hash_name)
+        size = 0
+        with open(full_path, "rb", buffering=0) as file_object:
+            while True:
+                if stop is not None and stop.is_set():
+                    return None
+                bytes_read = file_object.readinto(buffer)
+                if not bytes_read:
+                    break
+                h.update(view[:bytes_read])
+                size += bytes_read
+        return h.hexdigest(), size
+
+    def build_manifest(self, root_directory, paths = None):
+        paths = sorted(paths if paths is not None else self.list_files(root_directory))
+        for path in paths:
+            if "\n" in path or "\r" in path:
+                raise ValueError("file names with line breaks cannot be listed in a manifest: %r" % path)
+        full_paths = [os.path.join(root_directory, path) for path in paths]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            digests = list(executor.map(self.file_digest, full_paths))
+        lines = ["%s %s" % (MANIFEST_HEADER, self.hash_name)]
+        for path, (digest, size) in zip(paths, digests):
+            lines.append("%s %d %s" % (digest, size, path))
+        return ("\n".join(lines) + "\n").encode("utf8")
+
+    def manifest_digest(self, manifest):
+        hasher = hashes.Hash(self.signing_hash)
+        hasher.update(manifest)
+        return hasher.finalize()
+
+    def sign_manifest(self, private_key, manifest):
+        return private_key.sign(self.manifest_digest(manifest), utils.Prehashed(self.signing_hash))
+
+    def sign_directory(self, private_key, root_directory, paths = None):
+        manifest = self.build_manifest(root_directory, paths)
+        return manifest, self.sign_manifest(private_key, manifest)
+
+    def parse_manifest(self, manifest):
+        lines = manifest.decode("utf8").split("\n")
+        header = lines[0].split(" ")
+        if len(header) != 2 or header[0] != MANIFEST_HEADER:
+            raise ValueError("not a pycrypt manifest")
+        entries = []
+        for line in lines[1:]:
+            if line:
+                digest, size, path = line.split(" ", 2)
+                entries.append((path, int(size), digest))
+        return header[1], entries
+
+    # Raises InvalidSignature for a bad signature and ValueError naming the 
+    # first file found missing or changed, or with strict=True the files 
+    # that are not in the manifest.
+    def verify_directory(self, public_key, root_directory, manifest, signature, strict = False):
+        public_key.verify(signature, self.manifest_digest(manifest), utils.Prehashed(self.signing_hash))
+        hash_name, entries = self.parse_manifest(manifest)
+        if strict:
+            unlisted = sorted(set(self.list_files(root_directory)) - set(path for path, size, digest in entries))
+            if unlisted:
+                raise ValueError("files not in the manifest: %s" % ", ".join(unlisted[:10]) + (" and %d more" % (len(unlisted) - 10) if len(unlisted) > 10 else ""))
+        checker = DSA_Manifest_Signer(hash_name, self.max_workers, self.buffer_size)
+        for path, size, digest in entries:
+            full_path = os.path.join(root_directory, path)
+            if not os.path.isfile(full_path) or os.path.getsize(full_path) != size:
+                raise ValueError("%s is missing or changed size" % path)
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = {executor.submit(checker.file_digest, os.path.join(root_directory, path), stop): (path, (digest, size)) for path, size, digest in entries}
+            for future in as_completed(futures):
+                path, expected = futures[future]
+                if future.result() != expected:
+                    raise ValueError("%s does not match the manifest" % path)
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+        return True
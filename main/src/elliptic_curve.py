@@ -1,10 +1,13 @@
 import os
 import sys
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.asymmetric import utils
+from message_authentication import Streaming_hash_reader
+from crypto_utility import Signature_scheme, Batch_signature_verifier
 
 
 # Elliptic curves operations are also significantly faster; 
@@ -24,19 +27,58 @@ from cryptography.hazmat.primitives.asymmetric import utils
 #
 # ECDSA keys shall not be used for any other purpose (e.g., key establishment)
 
+
+# Curve selection
+#
+# Every class defaults to P-384, as before; use_curve() switches one to
+# another curve together with the hash that matches its security level.
+# P-256 is usually several times faster than P-384 and P-521 is slower 
+# still; run `python crypto_benchmark.py curves` to see the numbers for this host.
+#
+# Example Usage
+# signer = Elliptic_Curve_Signature_Algorithms()
+# signer.use_curve("P-256")
+
+EC_CURVES = {
+    "secp256r1" : (ec.SECP256R1, hashes.SHA256),
+    "secp384r1" : (ec.SECP384R1, hashes.SHA384),
+    "secp521r1" : (ec.SECP521R1, hashes.SHA512),
+    "secp256k1" : (ec.SECP256K1, hashes.SHA256),
+}
+
+EC_CURVE_ALIASES = {
+    "p-256"         : "secp256r1",
+    "p-384"         : "secp384r1",
+    "p-521"         : "secp521r1",
+    "prime256v1"    : "secp256r1",
+}
+
+# Returns (curve, hash algorithm) instances for a curve name or alias.
+def select_curve(name):
+    name = EC_CURVE_ALIASES.get(name.lower(), name.lower())
+    if name not in EC_CURVES:
+        raise ValueError("unsupported curve %r, expected one of %s" % (name, ", ".join(EC_CURVES)))
+    curve, hash_algorithm = EC_CURVES[name]
+    return curve(), hash_algorithm()
+
 class Elliptic_Curve_Signature_Algorithms():
     def __init__(self):
         self.author             = 'Busari Habibullaah'
         self.gen_private_key    = True
         self.data               = bytes('this is some data I\'d like to sign', encoding="utf8")
         self.hash               = hashes.SHA256()
+        self.curve              = ec.SECP384R1()
+        self.verification_cache = None  # optional crypto_utility.Signature_verification_cache
     
     def __repr__(self):
         return self
+
+    def use_curve(self, name):
+        self.curve, self.hash = select_curve(name)
     
     def generate_private_key(self):
         if self.gen_private_key:
-            private_key = ec.generate_private_key(ec.SECP384R1())
+            private_key = ec.generate_private_key(self.curve)
             return private_key
     
     def generate_public_key(self, private_key):
@@ -44,32 +86,83 @@ class Elliptic_Curve_Signature_Algorithms():
 
     def signature_message(self):
         if self.data:
-            signature = private_key.sign(self.data,ec.ECDSA(hashes.SHA256()))
+            signature = private_key.sign(self.data,ec.ECDSA(self.hash))
             return signature
 
     # If your data is too large to be passed in a single call, 
     # you can hash it separately and pass that value using Prehashed.
+    #
+    # data and more_data may each be a buffer (bytes, bytearray, memoryview,
+    # mmap, ...), a file path, a binary file object or an iterable of buffers.
+    # Buffers are hashed in place without a copy and files are streamed by 
+    # a Streaming_hash_reader, so a multi-gigabyte input is never held twice.
+    # hash_type=None uses self.hash.
+    #
+    # Example Usage
+    # with open("image.iso", "rb") as image_file, mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+    #     signature = signer.hash_and_sign_large_file_with_private_key(private_key, hashes.SHA256(), mapped)
+    # signature = signer.hash_and_sign_large_file_with_private_key(private_key, None, "image.iso")
 
-    def hash_and_sign_large_file_with_private_key(self, private_key, hash_type, data, more_data = None):
-        hasher  = hashes.Hash(hash_type)
-        bytes_to_hash = bytes(data)
-        more_data = bytes(more_data)
-        hasher.update(bytes_to_hash)
-        hasher.update(more_data)
-        digest = hasher.finalize()
-        if digest:
-            return private_key.sign(digest,ec.ECDSA(utils.Prehashed(self.hash))) 
+    def hash_large_data(self, hash_type, data, more_data = None, reader = None):
+        hasher = hashes.Hash(hash_type or self.hash)
+        (reader or Streaming_hash_reader()).feed(hasher, data, more_data)
+        return hasher.finalize()
+
+    def hash_and_sign_large_file_with_private_key(self, private_key, hash_type, data, more_data = None, reader = None):
+        hash_type = hash_type or self.hash
+        digest = self.hash_large_data(hash_type, data, more_data, reader)
+        return private_key.sign(digest,ec.ECDSA(utils.Prehashed(hash_type))) 
     
 
-    def hash_and_sign_large_file_with_public_key(self, public_key, signature, hash_type, data, more_data = None):
-        hasher = hashes.Hash(hash_type)
-        data_to_has_in_bytes = bytes(data)
-        more_data_in_bytes = bytes(more_data)
-        hasher.update(data_to_has_in_bytes)
-        hasher.update(more_data_in_bytes)
-        digest = hasher.finalize()
-        if digest:
-            return public_key.verify(signature, digest, ec.ECDSA(utils.Prehashed(self.hash)))
+    def hash_and_sign_large_file_with_public_key(self, public_key, signature, hash_type, data, more_data = None, reader = None):
+        hash_type = hash_type or self.hash
+        digest = self.hash_large_data(hash_type, data, more_data, reader)
+        if self.verification_cache is not None:
+            verifier = lambda: public_key.verify(signature, digest, ec.ECDSA(utils.Prehashed(hash_type)))
+            self.verification_cache.verify(public_key, signature, None, "ecdsa/" + hash_type.name, verifier, message_digest=digest)
+            return None
+        return public_key.verify(signature, digest, ec.ECDSA(utils.Prehashed(hash_type)))
+
+
+# Batch ECDSA verification
+#
+# verify_many() takes (public_key, signature, message) items, the public
+# key as a key object or its DER/PEM bytes, groups them by public key and
+# verifies each group in chunks on a worker pool sized to the cores. The 
+# scheduling, the key LRU, the error rule and the stats are those of 
+# crypto_utility.Batch_signature_verifier: the result is a bytearray in 
+# input order, 1 for a valid signature and 0 for any bad item.
+#
+# Example Usage
+# verifier = ECDSA_Batch_Verifier(hashes.SHA256())
+# results = verifier.verify_many([(public_key_der, signature, event) for ...])
+# print(verifier.last_batch["signatures_per_second"])
+
+ECDSA_HASHES = {
+    "sha256"    : hashes.SHA256,
+    "sha384"    : hashes.SHA384,
+    "sha512"    : hashes.SHA512,
+}
+
+def load_ecdsa_public_key(encoded, hash_name = None):
+    if encoded.startswith(b"-----"):
+        return serialization.load_pem_public_key(encoded)
+    return serialization.load_der_public_key(encoded)
+
+def encode_ecdsa_public_key(public_key, hash_name = None):
+    return public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+def verify_ecdsa_signature(public_key, signature, message, hash_name):
+    public_key.verify(signature, message, ec.ECDSA(ECDSA_HASHES[hash_name]()))
+
+class ECDSA_Batch_Verifier(Batch_signature_verifier):
+    def __init__(self, hash_algorithm = None, workers = None, chunk_size = 256, max_keys = 1024, use_processes = False):
+        hash_name = (hash_algorithm or hashes.SHA256()).name
+        if hash_name not in ECDSA_HASHES:
+            raise ValueError("unsupported ECDSA hash %r" % hash_name)
+        scheme = Signature_scheme("ecdsa-" + hash_name, ec.EllipticCurvePublicKey, load_ecdsa_public_key, encode_ecdsa_public_key, verify_ecdsa_signature, hash_name)
+        Batch_signature_verifier.__init__(self, scheme, workers, chunk_size, max_keys, use_processes, group_by_key=True)
+        self.hash_name = hash_name
 
 
 # This example does not give forward secrecy and is only provided as a demonstration of the 
@@ -82,13 +175,17 @@ class Elliptic_Curve_Key_Exchange_algorithm():
         self.hash_algorithm     = hashes.SHA256()
         self.key_length         = 32   # can be of any length (e.g, 1024, 2048, 256 and so on)
         self.data_to_encode     = bytes('handshake data', encoding="utf8")
+        self.curve              = ec.SECP384R1()
     
     def __repr__(self):
         return self
+
+    def use_curve(self, name):
+        self.curve, self.hash_algorithm = select_curve(name)
     
     def generate_server_private_key(self, generate_server_private_key = True):
         if generate_server_private_key:
-            server_private_key = ec.generate_private_key(ec.SECP384R1())
+            server_private_key = ec.generate_private_key(self.curve)
         return server_private_key
     
     # In a real handshake the peer is a remote client. For this
@@ -96,7 +193,7 @@ class Elliptic_Curve_Key_Exchange_algorithm():
 
     def generate_peer_private_key(self, generate_peer_private_key = True):
         if generate_peer_private_key:
-            peer_private_key = ec.generate_private_key(ec.SECP384R1())
+            peer_private_key = ec.generate_private_key(self.curve)
         return peer_private_key
     
     def shared_key_exchange(self, server_private_key, peer_private_key):
@@ -145,21 +242,28 @@ class ECDHE_key_Exchange_Ephemeral_Form:
         self.key_alogrithm  = hashes.SHA256()
         self.key_length     = 32
         self.handshake_data = bytes('Handshake Data', encoding="utf8")
+        self.key_pool       = None  # optional crypto_utility.Ephemeral_key_pool
+        self.curve          = ec.SECP384R1()
     
     def __repr__(self):
         return self
+
+    def use_curve(self, name):
+        self.curve, self.key_alogrithm = select_curve(name)
     
     # Generate a private key for use in the exchange.
     def generate_private_key(self):
+        if self.ephemeral and self.key_pool is not None:
+            return self.key_pool.acquire(self.curve.name)
         if self.ephemeral:
-            private_key = ec.generate_private_key(ec.SECP384R1())
+            private_key = ec.generate_private_key(self.curve)
         return private_key
     
     # In a real handshake the peer_public_key will be received from the
     # other party. For this example we'll generate another private key
     # and get a public key from that.
     def generate_peer_public_key(self):
-        peer_public_key = ec.generate_private_key(ec.SECP384R1()).public_key()
+        peer_public_key = ec.generate_private_key(self.curve).public_key()
         return peer_public_key
     
     def generate_shared_key(self, private_key):
@@ -175,12 +279,14 @@ class ECDHE_key_Exchange_Ephemeral_Form:
     
     # For the next handshake we MUST generate another private key.
     def generate_handshake_private_key(self):
-        private_key_2 = ec.generate_private_key(ec.SECP384R1())
+        if self.key_pool is not None:
+            return self.key_pool.acquire(self.curve.name)
+        private_key_2 = ec.generate_private_key(self.curve)
         return private_key_2
     
     def generate_handshake_peer_public_key(self, handshake_peer_public_key = True):
         if handshake_peer_public_key:
-            peer_public_key_2 = ec.generate_private_key(ec.SECP384R1()).public_key()
+            peer_public_key_2 = ec.generate_private_key(self.curve).public_key()
         return peer_public_key_2
     
     def generate_handshake_shared_key(self, peer_public_key_2, handshale_shared_key = True):
@@ -1,7 +1,28 @@
+import os
+import mmap
+import bisect
+import hashlib
+import json
+import queue
+import time
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.hazmat.primitives import cmac
+from cryptography.hazmat.primitives import constant_time
 from cryptography.hazmat.primitives import poly1305
 from cryptography.hazmat.primitives import hashes, hmac
-from cryptography.hazmat.primitives.ciphers import algorithms
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from benchmark_measurement import MESSAGE_SIZES
+from benchmark_measurement import benchmark_result
+from benchmark_measurement import measure_throughput
+
+try:
+    import numpy
+except ImportError:  # listed in requirements.txt; Content_defined_chunker falls back without it
+    numpy = None
 
 
 # While cryptography supports multiple MAC algorithms, 
@@ -11,6 +32,219 @@ from cryptography.hazmat.primitives.ciphers import algorithms
 
 
 
+# Streaming file hashing
+#
+# Hash and MAC contexts are incremental, so a file of any size can be fed
+# to them in pieces. Large inputs are either mapped into memory with mmap
+# and handed to update() as memoryview slices, or read with readinto()
+# into one page-aligned buffer that is reused for every read.
+# No per-chunk bytes objects are allocated on either path,
+# so checksumming very large archives stays I/O-bound.
+#
+# A reader keeps its buffers between calls, so an instance must not be shared between threads.
+#
+# Example Usage
+# reader = Streaming_hash_reader()
+# digest = Message_digests().digest_file("archive.tar", hashes.SHA256(), reader)
+# print(reader.bytes_per_second())
+
+class Streaming_hash_reader:
+    def __init__(self, buffer_size = 8 * 1024 * 1024, use_mmap = True, drop_cache = False):
+        self.buffer_size    = -(-buffer_size // mmap.PAGESIZE) * mmap.PAGESIZE
+        self.use_mmap       = use_mmap
+        self.drop_cache     = drop_cache
+        self.read_ahead_buffers = []
+        self.bytes_hashed   = 0
+        self.elapsed_time   = 0.0
+        self._buffer        = None
+    
+    # Allocated on first use: in-memory inputs never need it.
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            self._buffer = bytearray(self.buffer_size)
+            self._buffer_view = memoryview(self._buffer)
+        return self._buffer
+
+    @property
+    def buffer_view(self):
+        self.buffer
+        return self._buffer_view
+
+    # Bytes/sec of the most recent feed_* call.
+    def bytes_per_second(self):
+        if self.elapsed_time <= 0:
+            return 0.0
+        return self.bytes_hashed / self.elapsed_time
+
+    def _start(self):
+        self.bytes_hashed = 0
+        return time.perf_counter()
+    
+    def _stop(self, started):
+        self.elapsed_time = time.perf_counter() - started
+
+    # Tell the kernel the file is read front to back once, 
+    # so it reads ahead aggressively. 
+    # Ignored on platforms without posix_fadvise.
+    def _advise(self, file_descriptor, advice_name):
+        advice = getattr(os, advice_name, None)
+        if advice is not None and hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(file_descriptor, 0, 0, advice)
+            except OSError:
+                pass
+
+    def feed_path(self, context, file_path):
+        started = self._start()
+        with open(file_path, "rb", buffering=0) as file_object:
+            file_descriptor = file_object.fileno()
+            file_size = os.fstat(file_descriptor).st_size
+            self._advise(file_descriptor, "POSIX_FADV_SEQUENTIAL")
+            if self.use_mmap and file_size > 0:
+                self._feed_mmap(context, file_descriptor, file_size)
+            else:
+                self._feed_readinto(context, file_object)
+            if self.drop_cache:
+                self._advise(file_descriptor, "POSIX_FADV_DONTNEED")
+        self._stop(started)
+        return context
+
+    # Reads ahead in a second thread while this one hashes, so the next
+    # read overlaps the hashing of the current buffer. 
+    # The read buffers are kept and reused by later calls.
+    def feed_path_overlapped(self, context, file_path, buffer_count = 3):
+        started = self._start()
+        while len(self.read_ahead_buffers) < buffer_count - 1:
+            self.read_ahead_buffers.append(bytearray(self.buffer_size))
+        free_buffers = queue.Queue()
+        filled_buffers = queue.Queue()
+        for buffer in [self.buffer] + self.read_ahead_buffers[:buffer_count - 1]:
+            free_buffers.put(buffer)
+        stopped = threading.Event()
+
+        def read_ahead():
+            try:
+                with open(file_path, "rb", buffering=0) as file_object:
+                    self._advise(file_object.fileno(), "POSIX_FADV_SEQUENTIAL")
+                    while not stopped.is_set():
+                        buffer = free_buffers.get()
+                        bytes_read = file_object.readinto(buffer) if not stopped.is_set() else 0
+                        filled_buffers.put((buffer, bytes_read))
+                        if not bytes_read:
+                            break
+                    if self.drop_cache:
+                        self._advise(file_object.fileno(), "POSIX_FADV_DONTNEED")
+            except BaseException as error:
+                filled_buffers.put((None, error))
+
+        reader_thread = threading.Thread(target=read_ahead, daemon=True)
+        reader_thread.start()
+        try:
+            while True:
+                buffer, bytes_read = filled_buffers.get()
+                if buffer is None:
+                    raise bytes_read
+                if not bytes_read:
+                    break
+                with memoryview(buffer)[:bytes_read] as chunk:
+                    context.update(chunk)
+                self.bytes_hashed += bytes_read
+                free_buffers.put(buffer)
+        finally:
+            stopped.set()
+            free_buffers.put(self.buffer)
+            reader_thread.join()
+        self._stop(started)
+        return context
+
+    def feed_file_object(self, context, file_object):
+        started = self._start()
+        self._feed_readinto(context, file_object)
+        self._stop(started)
+        return context
+
+    # Feeds each input in turn: a path (str or os.PathLike), anything that
+    # supports the buffer protocol (bytes, bytearray, memoryview, mmap, 
+    # array, ...), a binary file object, or an iterable of such buffers.
+    # Buffers go to update() as memoryviews, never copied; None is skipped.
+    def feed(self, context, *inputs):
+        started = time.perf_counter()
+        total = 0
+        for data in inputs:
+            if data is None:
+                continue
+            if isinstance(data, (str, os.PathLike)):
+                self.feed_path(context, data)
+                total += self.bytes_hashed
+                continue
+            try:
+                view = memoryview(data)
+            except TypeError:
+                view = None
+            if view is not None:
+                total += self._feed_view(context, view)
+            elif hasattr(data, "readinto") or hasattr(data, "read"):
+                self.feed_file_object(context, data)
+                total += self.bytes_hashed
+            else:
+                for chunk in data:
+                    total += self._feed_view(context, memoryview(chunk))
+        self.bytes_hashed = total
+        self.elapsed_time = time.perf_counter() - started
+        return context
+
+    def _feed_view(self, context, view):
+        with view:
+            if not view.contiguous:
+                view = memoryview(view.tobytes())
+            elif view.ndim != 1 or view.format != "B":
+                view = view.cast("B")
+            with view:
+                context.update(view)
+                return view.nbytes
+
+    # asyncio.StreamReader (or anything with an awaitable read(n)).
+    async def feed_stream(self, context, stream_reader):
+        started = self._start()
+        while True:
+            chunk = await stream_reader.read(self.buffer_size)
+            if not chunk:
+                break
+            context.update(chunk)
+            self.bytes_hashed += len(chunk)
+        self._stop(started)
+        return context
+
+    def _feed_mmap(self, context, file_descriptor, file_size):
+        with mmap.mmap(file_descriptor, 0, access=mmap.ACCESS_READ) as mapped_file:
+            if hasattr(mapped_file, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped_file) as mapped_view:
+                for offset in range(0, file_size, self.buffer_size):
+                    with mapped_view[offset:offset + self.buffer_size] as chunk:
+                        context.update(chunk)
+        self.bytes_hashed += file_size
+
+    def _feed_readinto(self, context, file_object):
+        readinto = getattr(file_object, "readinto", None)
+        if readinto is None:
+            while True:
+                chunk = file_object.read(self.buffer_size)
+                if not chunk:
+                    break
+                context.update(chunk)
+                self.bytes_hashed += len(chunk)
+            return
+        while True:
+            bytes_read = readinto(self.buffer)
+            if not bytes_read:
+                break
+            with self.buffer_view[:bytes_read] as chunk:
+                context.update(chunk)
+            self.bytes_hashed += bytes_read
+
+
 # Cipher-based message authentication codes (or CMACs) 
 # are a tool for calculating message authentication codes 
 # using a block cipher coupled with a secret key. 
@@ -85,6 +319,187 @@ class Hash_based_message_authentication_codes:
             h_copy.verify(self.signature)
         return h_copy
 
+    # File and stream variants. Pass a Streaming_hash_reader to reuse its buffer
+    # across calls and to read the throughput of the last run.
+
+    def hmac_file(self, file_path, key, algorithm = None, reader = None):
+        h = hmac.HMAC(key, algorithm or hashes.SHA256())
+        (reader or Streaming_hash_reader()).feed_path(h, file_path)
+        return h.finalize()
+
+    def hmac_file_object(self, file_object, key, algorithm = None, reader = None):
+        h = hmac.HMAC(key, algorithm or hashes.SHA256())
+        (reader or Streaming_hash_reader(use_mmap=False)).feed_file_object(h, file_object)
+        return h.finalize()
+
+    async def hmac_stream(self, stream_reader, key, algorithm = None, reader = None):
+        h = hmac.HMAC(key, algorithm or hashes.SHA256())
+        await (reader or Streaming_hash_reader(use_mmap=False)).feed_stream(h, stream_reader)
+        return h.finalize()
+
+# Pre-keyed MAC templates
+#
+# Keying an HMAC hashes the key into the inner and outer pad states. 
+# That work is the same for every message under one key, 
+# so it can be done once and the keyed context cloned with copy() per message.
+# Keyed_template_cache keeps those keyed contexts in a bounded LRU, 
+# keyed by a caller-chosen key id.
+
+class Keyed_template_cache:
+    def __init__(self, make_template, key_loader, max_templates = 4096):
+        self.make_template  = make_template
+        self.key_loader     = key_loader
+        self.max_templates  = max_templates
+        self.templates      = OrderedDict()
+        self.lock           = threading.Lock()
+        self.hits           = 0
+        self.misses         = 0
+    
+    def __len__(self):
+        return len(self.templates)
+
+    # Returns a fresh clone of the keyed template, or None for an unknown key id.
+    def clone(self, key_id):
+        with self.lock:
+            template = self.templates.get(key_id)
+            if template is not None:
+                self.templates.move_to_end(key_id)
+                self.hits += 1
+                return template.copy()
+        key = self.key_loader(key_id)
+        if key is None:
+            return None
+        template = self.make_template(key)
+        with self.lock:
+            self.misses += 1
+            self.templates[key_id] = template
+            self.templates.move_to_end(key_id)
+            while len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        return template.copy()
+
+    # Drop a template, e.g. after the key for key_id was rotated.
+    def invalidate(self, key_id):
+        with self.lock:
+            self.templates.pop(key_id, None)
+
+
+# Batch HMAC verification with pre-keyed templates
+#
+# key_loader maps a key id to the raw key bytes (or None if unknown),
+# e.g. a dict's get method. verify_many() returns a bytearray with one
+# byte per item: 1 if the tag matched, 0 otherwise. 
+# Tags are compared with constant_time.bytes_eq, 
+# and no exception is raised per failed item.
+#
+# Example Usage
+# verifier = Pre_keyed_hmac_verifier({"client-1": os.urandom(32)}.get)
+# results = verifier.verify_many([("client-1", b"body", received_tag)])
+# print(results[0])
+
+class Pre_keyed_hmac_verifier:
+    def __init__(self, key_loader, algorithm = None, max_templates = 4096):
+        self.algorithm  = algorithm or hashes.SHA256()
+        self.templates  = Keyed_template_cache(self.make_hmac_template, key_loader, max_templates)
+    
+    def make_hmac_template(self, key):
+        return hmac.HMAC(key, self.algorithm)
+
+    def sign(self, key_id, message):
+        h = self.templates.clone(key_id)
+        if h is None:
+            raise KeyError(key_id)
+        h.update(message)
+        return h.finalize()
+
+    def verify(self, key_id, message, tag):
+        h = self.templates.clone(key_id)
+        if h is None:
+            return False
+        h.update(message)
+        return constant_time.bytes_eq(h.finalize(), bytes(tag))
+
+    def verify_many(self, items):
+        clone = self.templates.clone
+        bytes_eq = constant_time.bytes_eq
+        results = bytearray(len(items))
+        for index, (key_id, message, tag) in enumerate(items):
+            h = clone(key_id)
+            if h is None:
+                continue
+            h.update(message)
+            if bytes_eq(h.finalize(), bytes(tag)):
+                results[index] = 1
+        return results
+
+
+# Cached-key CMAC
+#
+# Same idea for AES-CMAC: the AES key schedule and CMAC subkeys are set up
+# once per key id, and every record is tagged on a copy() of that context.
+# tag_many() packs the 16-byte tags of a batch into one bytearray
+# (tag i is tags[16 * i:16 * i + 16]); verify_many() takes such a buffer.
+#
+# Example Usage
+# engine = Cached_cmac_engine({"peer-1": os.urandom(16)}.get)
+# tags = engine.tag_many("peer-1", records)
+# results = engine.verify_many("peer-1", records, tags)
+
+class Cached_cmac_engine:
+    def __init__(self, key_loader, max_templates = 4096):
+        self.templates  = Keyed_template_cache(self.make_cmac_template, key_loader, max_templates)
+        self.tag_length = 16
+    
+    def make_cmac_template(self, key):
+        return cmac.CMAC(algorithms.AES(key))
+
+    def _clone(self, key_id):
+        c = self.templates.clone(key_id)
+        if c is None:
+            raise KeyError(key_id)
+        return c
+
+    def tag(self, key_id, message):
+        c = self._clone(key_id)
+        c.update(message)
+        return c.finalize()
+
+    def tag_many(self, key_id, messages, out = None):
+        if out is None:
+            out = bytearray(self.tag_length * len(messages))
+        elif len(out) < self.tag_length * len(messages):
+            raise ValueError("output buffer is too small for %d tags" % len(messages))
+        template = self._clone(key_id)
+        tags = memoryview(out)
+        for index, message in enumerate(messages):
+            c = template.copy()
+            c.update(message)
+            tags[16 * index:16 * index + 16] = c.finalize()
+        return out
+
+    def verify_many(self, key_id, messages, tags):
+        results = bytearray(len(messages))
+        template = self._clone(key_id)
+        tags = memoryview(tags)
+        bytes_eq = constant_time.bytes_eq
+        for index, message in enumerate(messages):
+            c = template.copy()
+            c.update(message)
+            results[index] = bytes_eq(c.finalize(), bytes(tags[16 * index:16 * index + 16]))
+        return results
+
+    # Streaming mode, reading the file through a Streaming_hash_reader.
+    def tag_file(self, key_id, file_path, reader = None):
+        c = self._clone(key_id)
+        (reader or Streaming_hash_reader()).feed_path(c, file_path)
+        return c.finalize()
+
+    def tag_file_object(self, key_id, file_object, reader = None):
+        c = self._clone(key_id)
+        (reader or Streaming_hash_reader(use_mmap=False)).feed_file_object(c, file_object)
+        return c.finalize()
+
+
 # Poly1305 is an authenticator that takes a 32-byte key 
 # and a message and produces a 16-byte tag. 
 # This tag is used to authenticate the message. 
@@ -99,7 +514,7 @@ class Hash_based_message_authentication_codes:
 
 class Poly1305:
     def __init__(self):
-        self.message_to_authenticate = bytes("message to authenticate", encoding = True)
+        self.message_to_authenticate = bytes("message to authenticate", encoding = "utf8")
         self.use_incorrect_tag = bytes("an incorrect tag", encoding = "utf8")
     
 
@@ -135,7 +550,113 @@ class Poly1305:
 
     def verify_tag(self, key, use_verify_tag = True):
         if use_verify_tag:
-            return poly1305.Poly1305.verify_tag(key, self.message_to_authenticate self.use_incorrect_tag)
+            return poly1305.Poly1305.verify_tag(key, self.message_to_authenticate, self.use_incorrect_tag)
+
+
+# Poly1305 for packet streams
+#
+# Every packet needs its own one-time Poly1305 key. The authenticator 
+# first derives a MAC-only key from the 32-byte session key with HKDF-SHA256
+# (info names the stream), so its keystream never overlaps an encryption
+# keystream of the session key. The key of packet n is then the first 32
+# bytes of ChaCha20 keystream block n under the MAC key (the 32-bit block
+# counter holds the low half of n, the nonce holds the stream id and the 
+# high half): the RFC 8439 poly1305_key_gen construction with the packet 
+# number as counter.
+#
+# stream_id (4 bytes) is required and must differ per direction and per
+# sender sharing a session key; two streams with the same id would reuse 
+# one-time keys. Sender and receiver of one direction use the same id.
+#
+# Keys for a whole batch come from one keystream call, and tags are written
+# into a caller-supplied (or one preallocated) buffer of 16 bytes per packet.
+# The sender's sequence number only moves forward and is reserved under a
+# lock, so threads sharing one sender never tag two packets with the same 
+# one-time key; the receiver passes the sequence number carried by the 
+# packets and still has to reject replays itself.
+#
+# Example Usage
+# sender = Poly1305_packet_authenticator(session_key, b"c2s\x00")
+# first_sequence, tags = sender.tag_batch(packets)
+# receiver = Poly1305_packet_authenticator(session_key, b"c2s\x00")
+# results = receiver.verify_batch(packets, tags, first_sequence)
+
+class Poly1305_packet_authenticator:
+    def __init__(self, session_key, stream_id, batch_size = 1024):
+        if len(session_key) != 32:
+            raise ValueError("session_key must be 32 bytes")
+        if len(stream_id) != 4:
+            raise ValueError("stream_id must be 4 bytes")
+        self.stream_id      = bytes(stream_id)
+        self.mac_key        = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"poly1305 packet keys" + self.stream_id).derive(bytes(session_key))
+        self.batch_size     = batch_size
+        self.tag_length     = 16
+        self.next_sequence  = 0
+        self.sequence_lock  = threading.Lock()
+        self.zero_blocks    = bytes(64 * batch_size)
+        self.local          = threading.local()
+    
+    # Keystream holding the one-time keys of packets 
+    # first_sequence .. first_sequence + count - 1, 64 bytes per packet.
+    def packet_keys(self, first_sequence, count):
+        keystream = bytearray()
+        sequence = first_sequence
+        remaining = count
+        while remaining:
+            counter = sequence & 0xFFFFFFFF
+            blocks = min(remaining, 0x100000000 - counter)
+            nonce = counter.to_bytes(4, "little") + self.stream_id + (sequence >> 32).to_bytes(8, "little")
+            encryptor = Cipher(algorithms.ChaCha20(self.mac_key, nonce), mode=None).encryptor()
+            for offset in range(0, blocks, self.batch_size):
+                block_count = min(self.batch_size, blocks - offset)
+                keystream += encryptor.update(memoryview(self.zero_blocks)[:64 * block_count])
+            sequence += blocks
+            remaining -= blocks
+        return keystream
+
+    def _output_buffer(self, count, out):
+        if out is None:
+            if count > self.batch_size:
+                return bytearray(self.tag_length * count)
+            out = getattr(self.local, "tags", None)
+            if out is None:
+                out = self.local.tags = bytearray(self.tag_length * self.batch_size)
+        if len(out) < self.tag_length * count:
+            raise ValueError("output buffer is too small for %d tags" % count)
+        return out
+
+    # Tags the packets with the next sequence numbers. Returns 
+    # (first sequence number, tag buffer); tag i is out[16 * i:16 * i + 16].
+    # Without out, batches up to batch_size reuse one buffer per thread that
+    # the thread's next call overwrites.
+    def tag_batch(self, packets, out = None):
+        count = len(packets)
+        with self.sequence_lock:
+            first_sequence = self.next_sequence
+            if first_sequence + count > 0xFFFFFFFFFFFFFFFF:
+                raise OverflowError("packet sequence numbers exhausted, rekey the session")
+            self.next_sequence += count
+        out = self._output_buffer(count, out)
+        keys = memoryview(self.packet_keys(first_sequence, count))
+        tags = memoryview(out)
+        generate_tag = poly1305.Poly1305.generate_tag
+        for index, packet in enumerate(packets):
+            tags[16 * index:16 * index + 16] = generate_tag(keys[64 * index:64 * index + 32], packet)
+        return first_sequence, out
+
+    # One byte per packet in the returned bytearray: 1 if its tag is valid.
+    def verify_batch(self, packets, tags, first_sequence, results = None):
+        count = len(packets)
+        if results is None:
+            results = bytearray(count)
+        keys = memoryview(self.packet_keys(first_sequence, count))
+        tags = memoryview(tags)
+        generate_tag = poly1305.Poly1305.generate_tag
+        bytes_eq = constant_time.bytes_eq
+        for index, packet in enumerate(packets):
+            expected = generate_tag(keys[64 * index:64 * index + 32], packet)
+            results[index] = bytes_eq(expected, bytes(tags[16 * index:16 * index + 16]))
+        return results
 
 
 # Message digests (Hashing)
@@ -172,6 +693,651 @@ class Message_digests:
             digest.finalize()
         return digest
 
+    # File and stream variants of the digest above. 
+    # algorithm is a HashAlgorithm instance, e.g. hashes.BLAKE2b(64).
+
+    def digest_file(self, file_path, algorithm = None, reader = None):
+        digest = hashes.Hash(algorithm or hashes.SHA256())
+        (reader or Streaming_hash_reader()).feed_path(digest, file_path)
+        return digest.finalize()
+
+    def digest_file_object(self, file_object, algorithm = None, reader = None):
+        digest = hashes.Hash(algorithm or hashes.SHA256())
+        (reader or Streaming_hash_reader(use_mmap=False)).feed_file_object(digest, file_object)
+        return digest.finalize()
+
+    async def digest_stream(self, stream_reader, algorithm = None, reader = None):
+        digest = hashes.Hash(algorithm or hashes.SHA256())
+        await (reader or Streaming_hash_reader(use_mmap=False)).feed_stream(digest, stream_reader)
+        return digest.finalize()
+
+    # Tree-hash mode, see Merkle_tree_digests below. 
+    # Returns the root, or (root, manifest) when with_manifest is set.
+
+    def calculate_tree_digest(self, file_path, algorithm = "sha256", leaf_size = 4 * 1024 * 1024, with_manifest = False):
+        tree = Merkle_tree_digests(algorithm, leaf_size)
+        return tree.tree_digest_file(file_path, with_manifest)
+
+    # Incremental re-hash against a manifest from Incremental_file_digests,
+    # see below. Returns the new root and the block indexes that were re-hashed.
+
+    def update_digest(self, file_path, manifest, dirty_ranges = None, full_check = False, trust_samples = False):
+        incremental = Incremental_file_digests(manifest["algorithm"], manifest["leaf_size"], manifest.get("sample_size", 4096))
+        return incremental.update_digest(file_path, manifest, dirty_ranges, full_check, trust_samples)
+
+
+# Merkle tree hashing
+#
+# A sequential digest can only use one core. A tree hash splits the input 
+# into fixed-size leaves, hashes the leaves independently on a thread pool
+# and combines them pairwise into a single root. hashlib releases the GIL
+# while hashing buffers, and each worker reads its own leaf with pread,
+# so throughput scales with cores until the disk becomes the limit.
+#
+# Leaves and interior nodes are domain-separated (0x00 and 0x01 prefixes, 
+# as in RFC 6962), and an odd node at the end of a level is promoted unchanged.
+# The root is therefore not the same value as a plain digest of the file.
+#
+# The manifest lists every leaf digest, so a later check can re-hash only
+# the leaves covering the ranges it cares about.
+#
+# algorithm is a hashlib name or a Hash_algorithm_selector (see below); 
+# with a selector the tree uses its choice and the manifest records it
+# under "algorithm_selection". Incremental_file_digests takes the same.
+#
+# Example Usage
+# tree = Merkle_tree_digests("blake2b", leaf_size=8 * 1024 * 1024)
+# tree = Merkle_tree_digests(Hash_algorithm_selector(message_size=8 * 1024 * 1024))
+# root, manifest = tree.tree_digest_file("disk.img", with_manifest=True)
+# print(tree.verify_ranges("disk.img", manifest, [(0, 4096)]))
+# []
+
+class Merkle_tree_digests:
+    def __init__(self, algorithm = "sha256", leaf_size = 4 * 1024 * 1024, max_workers = None):
+        self.algorithm_selection = None
+        if isinstance(algorithm, Hash_algorithm_selector):
+            self.algorithm_selection = algorithm.metadata()
+            algorithm = self.algorithm_selection["algorithm"]
+        self.algorithm      = algorithm
+        self.leaf_size      = leaf_size
+        self.max_workers    = max_workers or os.cpu_count() or 1
+        self.leaf_prefix    = b"\x00"
+        self.node_prefix    = b"\x01"
+        self.thread_buffers = threading.local()
+        hashlib.new(algorithm)
+    
+    def leaf_digest(self, data):
+        h = hashlib.new(self.algorithm)
+        h.update(self.leaf_prefix)
+        h.update(data)
+        return h.digest()
+
+    def node_digest(self, left, right):
+        h = hashlib.new(self.algorithm)
+        h.update(self.node_prefix)
+        h.update(left)
+        h.update(right)
+        return h.digest()
+
+    def merkle_root(self, leaf_digests):
+        level = list(leaf_digests)
+        if not level:
+            return self.leaf_digest(b"")
+        while len(level) > 1:
+            next_level = [self.node_digest(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+            if len(level) % 2:
+                next_level.append(level[-1])
+            level = next_level
+        return level[0]
+
+    def leaf_count(self, size):
+        return max(1, -(-size // self.leaf_size))
+
+    # Indexes of the leaves that overlap the given (offset, length) ranges.
+    def leaf_indexes_for_ranges(self, ranges, size):
+        indexes = set()
+        last_leaf = self.leaf_count(size) - 1
+        for offset, length in ranges:
+            first = min(offset // self.leaf_size, last_leaf)
+            last = min((offset + max(length, 1) - 1) // self.leaf_size, last_leaf)
+            indexes.update(range(first, last + 1))
+        return sorted(indexes)
+
+    # Each worker thread keeps one leaf-sized buffer and fills it with pread,
+    # so no file position is shared between threads.
+    def _read_leaf(self, file_descriptor, index):
+        buffer = getattr(self.thread_buffers, "buffer", None)
+        if buffer is None or len(buffer) != self.leaf_size:
+            buffer = self.thread_buffers.buffer = bytearray(self.leaf_size)
+        view = memoryview(buffer)
+        offset = index * self.leaf_size
+        filled = 0
+        while filled < self.leaf_size:
+            bytes_read = os.preadv(file_descriptor, [view[filled:]], offset + filled)
+            if not bytes_read:
+                break
+            filled += bytes_read
+        return view[:filled]
+
+    def _hash_file_leaf(self, file_descriptor, index):
+        with self._read_leaf(file_descriptor, index) as data:
+            return self.leaf_digest(data)
+
+    def leaf_digests_for_file(self, file_path, leaf_indexes = None):
+        with open(file_path, "rb", buffering=0) as file_object:
+            file_descriptor = file_object.fileno()
+            size = os.fstat(file_descriptor).st_size
+            if leaf_indexes is None:
+                leaf_indexes = range(self.leaf_count(size))
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                digests = list(executor.map(lambda index: self._hash_file_leaf(file_descriptor, index), leaf_indexes))
+        return size, digests
+
+    def tree_digest_file(self, file_path, with_manifest = False):
+        size, leaves = self.leaf_digests_for_file(file_path)
+        root = self.merkle_root(leaves)
+        if with_manifest:
+            return root, self.build_manifest(size, leaves, root)
+        return root
+
+    def tree_digest_bytes(self, data, with_manifest = False):
+        view = memoryview(data).cast("B")
+        size = len(view)
+        offsets = range(0, max(size, 1), self.leaf_size)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            leaves = list(executor.map(lambda offset: self.leaf_digest(view[offset:offset + self.leaf_size]), offsets))
+        root = self.merkle_root(leaves)
+        if with_manifest:
+            return root, self.build_manifest(size, leaves, root)
+        return root
+
+    def build_manifest(self, size, leaves, root):
+        manifest = {
+            "version"   : 1,
+            "algorithm" : self.algorithm,
+            "leaf_size" : self.leaf_size,
+            "size"      : size,
+            "root"      : root.hex(),
+            "leaves"    : [leaf.hex() for leaf in leaves],
+        }
+        if self.algorithm_selection is not None:
+            manifest["algorithm_selection"] = self.algorithm_selection
+        return manifest
+
+    # Re-hash only the leaves covering ranges (all leaves if ranges is None)
+    # and return the indexes whose digest differs from the manifest.
+    # A file whose size changed reports every leaf from the old end onward.
+    def verify_ranges(self, file_path, manifest, ranges = None):
+        tree = Merkle_tree_digests(manifest["algorithm"], manifest["leaf_size"], self.max_workers)
+        size = os.stat(file_path).st_size
+        if ranges is None:
+            indexes = list(range(tree.leaf_count(size)))
+        else:
+            indexes = tree.leaf_indexes_for_ranges(ranges, size)
+        expected = manifest["leaves"]
+        _, digests = tree.leaf_digests_for_file(file_path, indexes)
+        mismatches = [index for index, digest in zip(indexes, digests) if index >= len(expected) or digest.hex() != expected[index]]
+        if size != manifest["size"]:
+            first_changed = min(size, manifest["size"]) // tree.leaf_size
+            changed_tail = range(first_changed, max(tree.leaf_count(size), len(expected)))
+            mismatches = sorted(set(mismatches).union(changed_tail))
+        return mismatches
+
+
+# Incremental file digests
+#
+# A persisted manifest extends the Merkle manifest above with the file's
+# mtime and a sample digest per block: the first and last sample_size bytes
+# of the block. update_digest() then re-hashes only the blocks that are 
+# known to have changed and rebuilds the root from the cached leaf digests:
+#
+#   - size and mtime unchanged: nothing is read, the cached root is returned.
+#   - blocks overlapping dirty_ranges (e.g. from a change journal) are re-hashed,
+#     and if the size changed, the old last block and everything after it.
+#     dirty_ranges=[] means the journal saw no writes.
+#   - size or mtime changed and dirty_ranges is None: every block is re-hashed.
+#
+# trust_samples=True replaces that last full pass with a sample check: a
+# block is re-hashed only when its sample digest no longer matches. That
+# reads two small pieces per block, but misses an in-place edit confined to
+# the middle of a block, so it is opt-in. The new mtime is recorded after a
+# pass over every block or a pass whose dirty_ranges the caller vouches for,
+# so the next call on an unchanged file reads nothing; after a sample pass
+# the old mtime stays and the next plain call re-hashes everything.
+# full_check=True always re-hashes everything.
+#
+# Example Usage
+# incremental = Incremental_file_digests()
+# manifest = incremental.create_manifest("volume.img")
+# incremental.save_manifest(manifest, "volume.img.manifest")
+# ...
+# manifest = incremental.load_manifest("volume.img.manifest")
+# root, rehashed_blocks = incremental.update_digest("volume.img", manifest)
+# incremental.save_manifest(manifest, "volume.img.manifest")
+
+class Incremental_file_digests:
+    def __init__(self, algorithm = "sha256", block_size = 4 * 1024 * 1024, sample_size = 4096, max_workers = None):
+        self.tree           = Merkle_tree_digests(algorithm, block_size, max_workers)
+        self.sample_size    = min(sample_size, block_size)
+    
+    def _block_sample(self, file_descriptor, index, size):
+        block_start = index * self.tree.leaf_size
+        block_end = min(block_start + self.tree.leaf_size, size)
+        h = hashlib.new(self.tree.algorithm)
+        h.update(os.pread(file_descriptor, self.sample_size, block_start))
+        h.update(os.pread(file_descriptor, self.sample_size, max(block_end - self.sample_size, block_start)))
+        return h.hexdigest()
+
+    def block_samples(self, file_path, indexes):
+        with open(file_path, "rb", buffering=0) as file_object:
+            file_descriptor = file_object.fileno()
+            size = os.fstat(file_descriptor).st_size
+            with ThreadPoolExecutor(max_workers=self.tree.max_workers) as executor:
+                return list(executor.map(lambda index: self._block_sample(file_descriptor, index, size), indexes))
+
+    def create_manifest(self, file_path):
+        stat_result = os.stat(file_path)
+        root, manifest = self.tree.tree_digest_file(file_path, with_manifest=True)
+        manifest["mtime_ns"] = stat_result.st_mtime_ns
+        manifest["sample_size"] = self.sample_size
+        manifest["samples"] = self.block_samples(file_path, range(len(manifest["leaves"])))
+        return manifest
+
+    # The manifest is written to a temporary file and renamed into place,
+    # so a crash never leaves a truncated manifest behind.
+    def save_manifest(self, manifest, manifest_path):
+        temporary_path = manifest_path + ".tmp"
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temporary_path, manifest_path)
+
+    def load_manifest(self, manifest_path):
+        with open(manifest_path, "r") as manifest_file:
+            return json.load(manifest_file)
+
+    # Updates manifest in place and returns (root, rehashed block indexes).
+    # Also accepts a plain Merkle manifest (no mtime or samples), which is
+    # treated as changed.
+    def update_digest(self, file_path, manifest, dirty_ranges = None, full_check = False, trust_samples = False):
+        tree = self.tree
+        stat_result = os.stat(file_path)
+        size = stat_result.st_size
+        unchanged = size == manifest["size"] and stat_result.st_mtime_ns == manifest.get("mtime_ns")
+        if unchanged and not dirty_ranges and not full_check:
+            return bytes.fromhex(manifest["root"]), []
+
+        block_count = tree.leaf_count(size)
+        old_block_count = len(manifest["leaves"])
+        old_samples = manifest.get("samples") or [""] * old_block_count
+        full_pass = full_check or (not unchanged and dirty_ranges is None and not trust_samples)
+        if full_pass:
+            dirty = set(range(block_count))
+        else:
+            dirty = set(tree.leaf_indexes_for_ranges(dirty_ranges or [], size))
+            if size != manifest["size"]:
+                dirty.update(range(min(size, manifest["size"]) // tree.leaf_size, block_count))
+            if not unchanged and trust_samples:
+                suspects = [index for index in range(min(block_count, old_block_count)) if index not in dirty]
+                samples = self.block_samples(file_path, suspects)
+                dirty.update(index for index, sample in zip(suspects, samples) if sample != old_samples[index])
+        dirty = sorted(index for index in dirty if index < block_count)
+
+        _, digests = tree.leaf_digests_for_file(file_path, dirty)
+        samples = self.block_samples(file_path, dirty)
+        leaves = (manifest["leaves"] + [""] * block_count)[:block_count]
+        block_samples = (old_samples + [""] * block_count)[:block_count]
+        for index, digest, sample in zip(dirty, digests, samples):
+            leaves[index] = digest.hex()
+            block_samples[index] = sample
+        root = tree.merkle_root(bytes.fromhex(leaf) for leaf in leaves)
+
+        # A sample pass does not vouch for the new mtime; a full pass or the
+        # caller's dirty_ranges do.
+        if full_pass or dirty_ranges is not None or len(dirty) == block_count:
+            manifest["mtime_ns"] = stat_result.st_mtime_ns
+        else:
+            manifest.setdefault("mtime_ns", None)
+        manifest["size"] = size
+        manifest["sample_size"] = self.sample_size
+        manifest["leaves"] = leaves
+        manifest["samples"] = block_samples
+        manifest["root"] = root.hex()
+        return root, dirty
+
+# Content-defined chunking
+#
+# Fixed-size blocks stop matching as soon as one byte is inserted near the 
+# start of a file. Content-defined chunking places chunk boundaries where a
+# rolling hash of the last few bytes matches a mask, so boundaries move with
+# the content and near-identical files (VM images, database snapshots) share
+# most of their chunks. Chunks with equal digests only need to be encrypted
+# and stored once.
+#
+# The cut rules are FastCDC's: no boundary before min_size, a harder mask 
+# up to normal_size and an easier one after it (normalized chunking), 
+# and a forced cut at max_size. The gear table is derived from SHA-256, 
+# so boundaries are stable across runs and machines.
+#
+# The rolling hash is a gear hash over a sliding window of window_size bytes,
+#
+#   h(i) = sum(gear[data[i - j]] << j for j in range(window_size))
+#
+# and only its low window_bits bits are tested. A per-byte Python loop would
+# run at a few MB/s, so the hash is computed for a whole segment at once
+# with integer arithmetic: the gear values are packed into the slots of one
+# large int, and log2(window_size) shift-and-add doublings turn every slot into h(i).
+# Only positions whose low byte is zero are then looked at in Python.
+#
+# With numpy (a requirement of this package) the same doubling runs on an
+# array of the narrowest unsigned type that holds window_bits bits: uint16
+# for the default sizes, uint32 or uint64 for larger ones. Only the low 
+# window_bits bits are tested and those depend on the last window_bits 
+# bytes alone, so the wrap-around of that type does not change any 
+# boundary: both paths cut at exactly the same offsets. The numpy path is
+# about ten times faster; use_numpy=None picks it and warns (RuntimeWarning)
+# when numpy is missing and the chunker falls back to pure Python.
+#
+# The chunker streams: it holds at most read_size + max_size bytes,
+# whatever the input size. crypto_benchmark.benchmark_content_chunking
+# measures it on this host.
+#
+# Example Usage
+# chunker = Content_defined_chunker()
+# for offset, length, digest in chunker.chunk_file("snapshot.db"):
+#     print(offset, length, digest.hex())
+
+CONTENT_CHUNKING_GEAR = [int.from_bytes(hashlib.sha256(index.to_bytes(1, "little")).digest()[:8], "little") for index in range(256)]
+
+class Content_defined_chunker:
+    def __init__(self, min_size = 2 * 1024, normal_size = 8 * 1024, max_size = 64 * 1024, algorithm = "sha256", read_size = 4 * 1024 * 1024, use_numpy = None):
+        if not 0 < min_size <= normal_size <= max_size:
+            raise ValueError("chunk sizes must satisfy 0 < min_size <= normal_size <= max_size")
+        if normal_size < 1024:
+            raise ValueError("normal_size must be at least 1024 bytes")
+        normal_bits         = normal_size.bit_length() - 1
+        # A boundary is never tested closer than the hash window to a chunk start.
+        self.min_size       = max(min_size, 64)
+        self.normal_size    = normal_size
+        self.max_size       = max_size
+        self.algorithm      = algorithm
+        self.read_size      = max(read_size, max_size)
+        self.scan_size      = 256 * 1024
+        self.mask_small     = (1 << (normal_bits + 2)) - 1
+        self.mask_large     = (1 << (normal_bits - 2)) - 1
+        self.window_bits    = max(16, normal_bits + 2)
+        self.window_size    = 1 << (self.window_bits - 1).bit_length()
+        self.slot_bytes     = (self.window_bits + self.window_size + 7) // 8
+        window_mask         = (1 << self.window_bits) - 1
+        self.gear_bytes     = [bytes(((gear & window_mask) >> (8 * index)) & 0xFF for gear in CONTENT_CHUNKING_GEAR) for index in range((self.window_bits + 7) // 8)]
+        if use_numpy and numpy is None:
+            raise ValueError("use_numpy requires numpy")
+        if use_numpy is None and numpy is None:
+            warnings.warn("numpy is not installed, Content_defined_chunker falls back to the pure Python scan (about 10x slower)", RuntimeWarning, stacklevel=2)
+        self.use_numpy      = numpy is not None if use_numpy is None else use_numpy
+        if self.use_numpy:
+            # The narrowest unsigned type holding window_bits bits; the hash wraps around in it.
+            self.gear_dtype = numpy.uint16 if self.window_bits <= 16 else numpy.uint32 if self.window_bits <= 32 else numpy.uint64
+            self.gear_array = numpy.array([gear & window_mask for gear in CONTENT_CHUNKING_GEAR], dtype=self.gear_dtype)
+        hashlib.new(algorithm)
+    
+    # Positions i (relative to data) where h(i) & mask_large == 0, 
+    # split into (weak, strong) where strong also satisfies mask_small.
+    def _boundary_candidates(self, data):
+        if self.use_numpy:
+            return self._boundary_candidates_numpy(data)
+        slot_bytes = self.slot_bytes
+        count = len(data)
+        source = bytes(data)
+        packed = bytearray(slot_bytes * count)
+        for index, table in enumerate(self.gear_bytes):
+            packed[index::slot_bytes] = source.translate(table)
+        rolling_hash = int.from_bytes(packed, "little")
+        del packed
+        width = 1
+        while width < self.window_size:
+            rolling_hash += rolling_hash << (width * 8 * slot_bytes + width)
+            width *= 2
+        slots = rolling_hash.to_bytes(slot_bytes * (count + self.window_size) + 8, "little")
+        del rolling_hash
+        low_bytes = slots[0:slot_bytes * count:slot_bytes]
+        weak, strong = [], []
+        position = low_bytes.find(0)
+        while position != -1:
+            value = int.from_bytes(slots[position * slot_bytes:(position + 1) * slot_bytes], "little")
+            if not value & self.mask_large:
+                weak.append(position)
+                if not value & self.mask_small:
+                    strong.append(position)
+            position = low_bytes.find(0, position + 1)
+        return weak, strong
+
+    def _boundary_candidates_numpy(self, data):
+        dtype = self.gear_dtype
+        rolling_hash = self.gear_array.take(numpy.frombuffer(data, dtype=numpy.uint8))
+        shifted = numpy.empty_like(rolling_hash)
+        width = 1
+        while width < self.window_size:
+            numpy.left_shift(rolling_hash[:-width], dtype(width), out=shifted[width:])
+            numpy.add(rolling_hash[width:], shifted[width:], out=rolling_hash[width:])
+            width *= 2
+        weak = numpy.flatnonzero((rolling_hash & dtype(self.mask_large)) == 0)
+        strong = weak[(rolling_hash.take(weak) & dtype(self.mask_small)) == 0]
+        return weak.tolist(), strong.tolist()
+
+    def _scan(self, view):
+        weak, strong = [], []
+        context = self.window_size - 1
+        for start in range(0, len(view), self.scan_size):
+            segment_start = max(start - context, 0)
+            segment_weak, segment_strong = self._boundary_candidates(view[segment_start:start + self.scan_size])
+            weak.extend(position + segment_start for position in segment_weak if position + segment_start >= start)
+            strong.extend(position + segment_start for position in segment_strong if position + segment_start >= start)
+        return weak, strong
+
+    # Lengths of the complete chunks at the start of view. 
+    # Unless end_of_data is set, a tail shorter than max_size is left 
+    # for the next call because its boundary may depend on bytes not read yet.
+    def chunk_lengths(self, view, end_of_data = True):
+        weak, strong = self._scan(view)
+        lengths = []
+        start = 0
+        end = len(view)
+        while end - start >= self.max_size or (end_of_data and start < end):
+            cut = None
+            first = start + self.min_size
+            normal_end = start + self.normal_size
+            index = bisect.bisect_left(strong, first)
+            if index < len(strong) and strong[index] < min(normal_end, end):
+                cut = strong[index] + 1
+            else:
+                index = bisect.bisect_left(weak, max(first, normal_end))
+                if index < len(weak) and weak[index] < min(start + self.max_size, end):
+                    cut = weak[index] + 1
+            if cut is None:
+                cut = min(start + self.max_size, end)
+            lengths.append(cut - start)
+            start = cut
+        return lengths
+
+    def chunk_digest(self, data):
+        return hashlib.new(self.algorithm, data).digest()
+
+    # Yields (offset, length, digest) for every chunk of a bytes-like object,
+    # e.g. an mmap of a file, in windows of read_size bytes.
+    def chunk_bytes(self, data):
+        view = memoryview(data).cast("B")
+        position = 0
+        while position < len(view):
+            window_end = min(position + self.read_size + self.max_size, len(view))
+            window = view[position:window_end]
+            for length in self.chunk_lengths(window, window_end == len(view)):
+                yield position, length, self.chunk_digest(view[position:position + length])
+                position += length
+
+    def chunk_file_object(self, file_object):
+        buffer = bytearray()
+        buffer_offset = 0
+        end_of_file = False
+        while True:
+            while not end_of_file and len(buffer) < self.read_size:
+                data = file_object.read(self.read_size)
+                if not data:
+                    end_of_file = True
+                buffer += data
+            if not buffer:
+                return
+            position = 0
+            with memoryview(buffer) as view:
+                for length in self.chunk_lengths(view, end_of_file):
+                    digest = self.chunk_digest(view[position:position + length])
+                    yield buffer_offset + position, length, digest
+                    position += length
+            del buffer[:position]
+            buffer_offset += position
+
+    def chunk_file(self, file_path):
+        with open(file_path, "rb") as file_object:
+            yield from self.chunk_file_object(file_object)
+
+
+# Chunk index shared by many files
+#
+# Records every chunk digest seen so far. add_chunks() returns the chunk 
+# index of one file as (offset, length, digest, is_new) entries; only the
+# chunks marked new have to be encrypted and written to storage.
+
+class Deduplicated_chunk_index:
+    def __init__(self, chunker = None):
+        self.chunker        = chunker or Content_defined_chunker()
+        self.known_digests  = set()
+        self.total_bytes    = 0
+        self.stored_bytes   = 0
+    
+    def add_chunks(self, chunks):
+        index = []
+        for offset, length, digest in chunks:
+            is_new = digest not in self.known_digests
+            if is_new:
+                self.known_digests.add(digest)
+                self.stored_bytes += length
+            self.total_bytes += length
+            index.append((offset, length, digest, is_new))
+        return index
+
+    def add_file(self, file_path):
+        return self.add_chunks(self.chunker.chunk_file(file_path))
+
+    def deduplication_ratio(self):
+        if not self.stored_bytes:
+            return 1.0
+        return self.total_bytes / self.stored_bytes
+
+
+# Hash algorithm registry and selection
+#
+# Names follow hashlib, so the same name works for hashes.Hash (through 
+# hash_algorithm_by_name) and for the hashlib based tree and chunk digests above.
+# Which algorithm is fastest per byte depends on the CPU: SHA-256 wins
+# where SHA extensions exist, BLAKE2b or SHA-512 often win on 64-bit CPUs without them.
+#
+# Hash_algorithm_selector picks the fastest algorithm allowed by a policy, 
+# for integrity-only uses, from crypto_benchmark results (or a short 
+# benchmark_hashes() run on this host when none are given). metadata() 
+# describes the choice; Merkle_tree_digests and Incremental_file_digests
+# accept a selector in place of an algorithm name and store that metadata
+# in their manifests, next to the digests it produced.
+#
+# Example Usage
+# selector = Hash_algorithm_selector(message_size=4 * 1024 * 1024)
+# tree = Merkle_tree_digests(selector)
+# root, manifest = tree.tree_digest_file("disk.img", with_manifest=True)
+# print(manifest["algorithm"], manifest["algorithm_selection"])
+
+HASH_ALGORITHMS = {
+    "sha224"        : hashes.SHA224,
+    "sha256"        : hashes.SHA256,
+    "sha384"        : hashes.SHA384,
+    "sha512"        : hashes.SHA512,
+    "sha512_256"    : hashes.SHA512_256,
+    "sha3_256"      : hashes.SHA3_256,
+    "sha3_512"      : hashes.SHA3_512,
+    "blake2b"       : lambda: hashes.BLAKE2b(64),
+    "blake2s"       : lambda: hashes.BLAKE2s(32),
+    "sha1"          : hashes.SHA1,
+    "md5"           : hashes.MD5,
+}
+
+# SHA-1 and MD5 are broken, see the notes below; they are benchmarked but never selected.
+INTEGRITY_HASH_POLICY = ("sha256", "sha384", "sha512", "sha512_256", "sha3_256", "sha3_512", "blake2b", "blake2s")
+
+def hash_algorithm_by_name(name):
+    return HASH_ALGORITHMS[name]()
+
+def _one_shot_hash(algorithm, message):
+    digest = hashes.Hash(algorithm)
+    digest.update(message)
+    return digest.finalize()
+
+# One "hash" entry per algorithm and message size, as crypto_benchmark writes them.
+def benchmark_hashes(sizes = MESSAGE_SIZES, names = None, min_time = 0.2):
+    results = []
+    for name in names or HASH_ALGORITHMS:
+        algorithm = HASH_ALGORITHMS[name]()
+        for size in sizes:
+            message = os.urandom(size)
+            results.append(benchmark_result("hash", name, size, measure_throughput(lambda: _one_shot_hash(algorithm, message), size, min_time)))
+    return results
+
+class Hash_algorithm_selector:
+    def __init__(self, benchmark_results = None, allowed = INTEGRITY_HASH_POLICY, message_size = 1024 * 1024, default = "sha256"):
+        self.benchmark_results  = benchmark_results
+        self.allowed            = tuple(allowed)
+        self.message_size       = message_size
+        self.default            = default
+        self.selection          = None
+    
+    def _hash_results(self):
+        results = self.benchmark_results
+        if results is None:
+            results = self.benchmark_results = benchmark_hashes(sizes=[self.message_size], names=self.allowed, min_time=0.05)
+        if isinstance(results, str):
+            with open(results, "r") as results_file:
+                results = json.load(results_file)
+        if isinstance(results, dict):
+            results = results["results"]
+        flattened = []
+        for entry in results:
+            flattened.extend(entry if isinstance(entry, list) else [entry])
+        return [entry for entry in flattened if entry.get("benchmark") == "hash" and entry.get("algorithm") in self.allowed]
+
+    # Name of the fastest allowed hash at the benchmarked message size 
+    # closest to message_size; the policy default when nothing was measured.
+    def select(self):
+        candidates = self._hash_results()
+        if not candidates:
+            self.selection = {"algorithm": self.default, "selected_by": "default"}
+            return self.default
+        measured_size = min({entry["message_size"] for entry in candidates}, key=lambda size: abs(size - self.message_size))
+        fastest = max((entry for entry in candidates if entry["message_size"] == measured_size), key=lambda entry: entry["bytes_per_second"])
+        self.selection = {
+            "algorithm"         : fastest["algorithm"],
+            "selected_by"       : "benchmark",
+            "message_size"      : measured_size,
+            "bytes_per_second"  : fastest["bytes_per_second"],
+        }
+        return fastest["algorithm"]
+
+    def hash_algorithm(self):
+        return hash_algorithm_by_name(self.select())
+
+    def metadata(self):
+        if self.selection is None:
+            self.select()
+        return dict(self.selection, use="integrity", policy=list(self.allowed))
+
+
 # SHA-2 family
 #
 # SHA-224 is a cryptographic hash function from the SHA-2 family 
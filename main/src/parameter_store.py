@@ -0,0 +1,79 @@
+import os
+import json
+import threading
+
+
+# Parameter store
+#
+# Domain parameters (DH groups, DSA p/q/g) take seconds to minutes to
+# generate and can be shared by any number of keys. A store generates each
+# named parameter set once, keeps it in memory and persists it in directory
+# as one JSON file per name, in the same format for every algorithm:
+#
+#   {"algorithm": "dh", "p": "<hex>", "q": "<hex or null>", "g": "<hex>"}
+#
+# Files are written to a temporary file, fsynced and renamed into place, so
+# a crash never leaves a truncated parameter set behind. A set whose prime
+# does not have key_size bits raises ValueError.
+#
+# Subclasses name the algorithm and convert between parameters and numbers;
+# DH_Parameter_Cache (diffie_hellman.py) and DSA_Parameter_Store (dsa.py)
+# are the two in this library.
+
+class Parameter_store:
+    algorithm = None
+
+    def __init__(self, directory):
+        self.directory  = directory
+        self.parameters = {}
+        self.lock       = threading.Lock()
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, "%s.json" % name)
+
+    # Returns (p, q or None, g) of parameters.
+    def parameter_numbers(self, parameters):
+        raise NotImplementedError
+
+    def parameters_from_numbers(self, p, q, g):
+        raise NotImplementedError
+
+    def generate_parameters(self, key_size, **options):
+        raise NotImplementedError
+
+    def get_parameters(self, name = "default", key_size = 2048, **options):
+        with self.lock:
+            parameters = self.parameters.get(name)
+            if parameters is None:
+                parameters = self.load_parameters(name)
+            if parameters is None:
+                parameters = self.generate_parameters(key_size, **options)
+                self.save_parameters(name, parameters)
+            if self.parameter_numbers(parameters)[0].bit_length() != key_size:
+                raise ValueError("parameter set %r is not %d bits" % (name, key_size))
+            self.parameters[name] = parameters
+            return parameters
+
+    def load_parameters(self, name):
+        try:
+            with open(self._path(name), "r") as parameter_file:
+                numbers = json.load(parameter_file)
+        except FileNotFoundError:
+            return None
+        if numbers.get("algorithm", self.algorithm) != self.algorithm:
+            raise ValueError("parameter set %r holds %s parameters, not %s" % (name, numbers["algorithm"], self.algorithm))
+        q = numbers.get("q")
+        return self.parameters_from_numbers(int(numbers["p"], 16), int(q, 16) if q else None, int(numbers["g"], 16))
+
+    def save_parameters(self, name, parameters):
+        p, q, g = self.parameter_numbers(parameters)
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = self._path(name) + ".tmp"
+        with open(temporary_path, "w") as parameter_file:
+            json.dump({"algorithm": self.algorithm, "p": "%x" % p, "q": "%x" % q if q else None, "g": "%x" % g}, parameter_file)
+            parameter_file.flush()
+            os.fsync(parameter_file.fileno())
+        os.replace(temporary_path, self._path(name))
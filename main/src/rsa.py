@@ -1,8 +1,22 @@
+import io
+import os
+import time
+import struct
+import hashlib
+import threading
+from collections import deque
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import utils
 from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from message_authentication import Streaming_hash_reader
 
 # copyright: Sandcroft software.
 # Author: Busari Habibullaah
@@ -33,12 +47,17 @@ class RSA_Key_Algorithm:
         self.serialze_with_no_pass_encryption_algorithm  = serialization.NoEncryption()
         self.key_serialization_format_no_password        = serialization.PrivateFormat.TraditionalOpenSSL
         self.serialze_with_password_encryption_algorithm = serialization.BestAvailableEncryption(self.key_serialize_password)
+        self.key_pool                   = None  # optional RSA_Key_Pool, see below
+        self.key_cache                  = None  # optional Private_key_cache, see below
+        self.verification_cache         = None  # optional crypto_utility.Signature_verification_cache
     
 
     def __repr__(self):
         return self
     
     def generate_rsa_private_key(self, generate_new_key = True):
+        if generate_new_key and self.key_pool is not None:
+            return self.key_pool.acquire(self.key_size, self.public_exponent)
         if generate_new_key:
             private_key = rsa.generate_private_key(public_exponent=self.public_exponent,key_size=self.key_size,backend=default_backend())
         return private_key
@@ -50,6 +69,8 @@ class RSA_Key_Algorithm:
     # you can load it:
 
     def load_private_key_from_disk_PEM_FORMAT(self, file_path_to_key_dot_pem, file_passsword = None):
+        if self.key_cache is not None:
+            return self.key_cache.load(file_path_to_key_dot_pem, file_passsword)
         with open(file_path_to_key_dot_pem, "rb") as key_file:
             private_key = serialization.load_pem_private_key(key_file.read(),password=file_passsword,backend=default_backend())
         return private_key
@@ -86,19 +107,50 @@ class RSA_Key_Algorithm:
     def serialized_key_verification(self, private_key, signature, message, verify_key = True):
         if private_key:
             public_key = private_key.public_key()
-            public_key.verify(signature, message, padding.PSS(mgf=padding.MGF1(self.hash_type),salt_length=self.salt_key_length),self.hash_type)
+            verifier = lambda: public_key.verify(signature, message, padding.PSS(mgf=padding.MGF1(self.hash_type),salt_length=self.salt_key_length),self.hash_type)
+            if self.verification_cache is not None:
+                self.verification_cache.verify(public_key, signature, message, self.verification_parameters(), verifier)
+            else:
+                verifier()
             return public_key
     
-    def serialize_large_key_verification(self, signature, verify_key = True):
+    # Everything besides key, message and signature that decides whether
+    # a signature verifies; part of the verification cache entry.
+    def verification_parameters(self):
+        return "rsa-pss/%s/%s" % (self.hash_type.name, "max" if self.salt_key_length is padding.PSS.MAX_LENGTH else self.salt_key_length)
+    
+    def serialize_large_key_verification(self, public_key, signature, verify_key = True):
         if verify_key:
             chosen_hash = self.hash_type
             hasher = hashes.Hash(chosen_hash)
             hasher.update(self.message_to_sign_and_verify)
-            hasher.update(self.message_to_sign_and_verify)
             digest = hasher.finalize()
             public_key.verify(signature, digest, padding.PSS(mgf=padding.MGF1(self.hash_type),salt_length=self.salt_key_length),utils.Prehashed(chosen_hash))
             return public_key
     
+    # Signing and verifying files of any size. The file is streamed through
+    # hashes.Hash in large reused buffers, reading the next buffer in a second
+    # thread while the current one is hashed, and only the digest is signed 
+    # (utils.Prehashed). Memory use is constant whatever the file size.
+
+    def file_digest(self, file_path, reader = None):
+        hasher = hashes.Hash(self.hash_type)
+        (reader or Streaming_hash_reader()).feed_path_overlapped(hasher, file_path)
+        return hasher.finalize()
+
+    def sign_file(self, file_path, private_key, reader = None):
+        digest = self.file_digest(file_path, reader)
+        return private_key.sign(digest, padding.PSS(mgf=padding.MGF1(self.hash_type),salt_length=self.salt_key_length), utils.Prehashed(self.hash_type))
+
+    # Raises InvalidSignature if the file does not match the signature.
+    def verify_file(self, file_path, signature, public_key, reader = None):
+        digest = self.file_digest(file_path, reader)
+        verifier = lambda: public_key.verify(signature, digest, padding.PSS(mgf=padding.MGF1(self.hash_type),salt_length=self.salt_key_length), utils.Prehashed(self.hash_type))
+        if self.verification_cache is not None:
+            return self.verification_cache.verify(public_key, signature, None, self.verification_parameters(), verifier, message_digest=digest)
+        verifier()
+        return True
+    
     # encryption is performed using the public key, meaning anyone can encrypt data. 
     # The data is then decrypted using the private key.
 
@@ -116,7 +168,499 @@ class RSA_Key_Algorithm:
             plaintext = private_key.decrypt(ciphertext, padding.OAEP(mgf=padding.MGF1(algorithm=self.hash_type),algorithm=self.hash_type,label=None))
         return plaintext
 
+    # OAEP can only encrypt about 190 bytes with a 2048-bit key. 
+    # Larger messages go into an envelope, see RSA_Envelope_Encryption below.
+
+    def encrypt_large_message_data(self, public_key, message_to_encrypt):
+        return RSA_Envelope_Encryption(hash_type=self.hash_type).encrypt(public_key, message_to_encrypt)
+
+    def decrypt_large_message_data(self, private_key, envelope):
+        return RSA_Envelope_Encryption(hash_type=self.hash_type).decrypt(private_key, envelope)
+
     def decryption_verification(self, plaintext, message, decrypt_verification = True):
         if decrypt_verification:
             if plaintext == message:
                 return True
+
+
+# Background RSA key pool
+#
+# Generating a 3072 or 4096-bit RSA key takes hundreds of milliseconds to seconds. 
+# The pool keeps pre-generated keys per (key size, public exponent) and
+# refills itself in worker processes whenever a pool drops to low_watermark,
+# up to high_watermark, so acquire() is a deque pop. 
+# When a pool is empty acquire() generates the key inline and counts a miss.
+#
+# Keys cross the process boundary as unencrypted PKCS8 DER over a local pipe.
+# On close() the remaining keys can be written to persist_path, encrypted 
+# with persist_password, and are loaded again by the next pool. The file is
+# deleted once it has been read, so a key is never handed out twice.
+#
+# Example Usage
+# pool = RSA_Key_Pool(key_specs=[(3072, 65537)], low_watermark=8, high_watermark=32, persist_path="rsa_pool.pem", persist_password=b"pool password")
+# private_key = pool.acquire(3072)
+# print(pool.metrics())
+# pool.close()
+
+def generate_rsa_key_der(key_size, public_exponent):
+    private_key = rsa.generate_private_key(public_exponent=public_exponent, key_size=key_size)
+    return private_key.private_bytes(encoding=serialization.Encoding.DER, format=serialization.PrivateFormat.PKCS8, encryption_algorithm=serialization.NoEncryption())
+
+class RSA_Key_Pool:
+    def __init__(self, key_specs = ((2048, 65537),), low_watermark = 4, high_watermark = 16, workers = None, persist_path = None, persist_password = None):
+        if not 0 <= low_watermark < high_watermark:
+            raise ValueError("low_watermark must be smaller than high_watermark")
+        if persist_path is not None and not persist_password:
+            raise ValueError("persist_password is required to persist the pool")
+        self.low_watermark      = low_watermark
+        self.high_watermark     = high_watermark
+        self.persist_path       = persist_path
+        self.persist_password   = persist_password
+        self.keys               = {tuple(spec): deque() for spec in key_specs}
+        self.pending            = {tuple(spec): 0 for spec in key_specs}
+        self.condition          = threading.Condition()
+        self.generated          = 0
+        self.handed_out         = 0
+        self.misses             = 0
+        self.completion_times   = deque(maxlen=64)
+        self.closed             = False
+        self.executor           = ProcessPoolExecutor(max_workers=workers)
+        self.load_persisted_keys()
+        for spec in self.keys:
+            self.refill(spec)
+    
+    def _spec_of(self, private_key):
+        return (private_key.key_size, private_key.public_key().public_numbers().e)
+
+    # Starts generating keys for spec if its pool dropped to the low watermark.
+    def refill(self, spec):
+        with self.condition:
+            if self.closed:
+                return
+            available = len(self.keys[spec]) + self.pending[spec]
+            if available > self.low_watermark:
+                return
+            for _ in range(self.high_watermark - available):
+                self.pending[spec] += 1
+                future = self.executor.submit(generate_rsa_key_der, spec[0], spec[1])
+                future.add_done_callback(lambda future, spec = spec: self._key_generated(spec, future))
+
+    def _key_generated(self, spec, future):
+        private_key = None
+        if not future.cancelled() and future.exception() is None:
+            private_key = serialization.load_der_private_key(future.result(), password=None)
+        with self.condition:
+            self.pending[spec] -= 1
+            if private_key is not None and not self.closed:
+                self.keys[spec].append(private_key)
+                self.generated += 1
+                self.completion_times.append(time.monotonic())
+                self.condition.notify_all()
+
+    # Returns a key from the pool, waiting up to timeout seconds for one
+    # (0 means do not wait) before falling back to generating it inline.
+    def acquire(self, key_size = 2048, public_exponent = 65537, timeout = 0):
+        spec = (key_size, public_exponent)
+        with self.condition:
+            if spec not in self.keys:
+                self.keys[spec] = deque()
+                self.pending[spec] = 0
+            pool = self.keys[spec]
+            if not pool and timeout:
+                # Start generating before waiting, so the wait overlaps the
+                # work (the condition's lock is reentrant).
+                self.refill(spec)
+                self.condition.wait_for(lambda: pool, timeout)
+            private_key = pool.popleft() if pool else None
+            if private_key is None:
+                self.misses += 1
+            else:
+                self.handed_out += 1
+        self.refill(spec)
+        if private_key is None:
+            private_key = rsa.generate_private_key(public_exponent=public_exponent, key_size=key_size, backend=default_backend())
+        return private_key
+
+    # Keys per second over the last completions, across all specs.
+    def refill_rate(self):
+        with self.condition:
+            if len(self.completion_times) < 2:
+                return 0.0
+            elapsed = self.completion_times[-1] - self.completion_times[0]
+            return (len(self.completion_times) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def metrics(self):
+        refill_rate = self.refill_rate()
+        with self.condition:
+            return {
+                "depth"             : {"%d/%d" % spec: len(keys) for spec, keys in self.keys.items()},
+                "pending"           : {"%d/%d" % spec: count for spec, count in self.pending.items()},
+                "generated"         : self.generated,
+                "handed_out"        : self.handed_out,
+                "misses"            : self.misses,
+                "refill_rate"       : refill_rate,
+            }
+
+    def load_persisted_keys(self):
+        if self.persist_path is None or not os.path.exists(self.persist_path):
+            return
+        with open(self.persist_path, "rb") as pool_file:
+            pem_data = pool_file.read()
+        os.remove(self.persist_path)
+        end_marker = b"-----END ENCRYPTED PRIVATE KEY-----"
+        for block in pem_data.split(end_marker)[:-1]:
+            private_key = serialization.load_pem_private_key(block + end_marker, password=self.persist_password)
+            spec = self._spec_of(private_key)
+            self.keys.setdefault(spec, deque()).append(private_key)
+            self.pending.setdefault(spec, 0)
+
+    # Stops the workers and, with persist_path set, moves the remaining keys
+    # to disk. The pool is empty afterwards.
+    def close(self):
+        with self.condition:
+            self.closed = True
+            keys = [private_key for pool in self.keys.values() for private_key in pool]
+            for pool in self.keys.values():
+                pool.clear()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.persist_path is None or not keys:
+            return
+        encryption = serialization.BestAvailableEncryption(self.persist_password)
+        file_descriptor = os.open(self.persist_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, "wb") as pool_file:
+            for private_key in keys:
+                pool_file.write(private_key.private_bytes(encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.PKCS8, encryption_algorithm=encryption))
+
+
+# Parsed private key cache
+#
+# Decrypting a password-protected PKCS8 file and parsing the key costs far 
+# more than the signature made with it. The cache keeps parsed key objects 
+# keyed by (path, inode, mtime, size, password digest): a replaced or 
+# rewritten file gets a new identity and is loaded again on the next call,
+# and entries also expire after ttl seconds and are evicted LRU beyond max_entries.
+#
+# Concurrent loads of the same identity are deduplicated: the first caller
+# parses the file and the others wait for its result, so a thundering herd
+# at startup parses each key once.
+#
+# Example Usage
+# algorithm = RSA_Key_Algorithm()
+# algorithm.key_cache = Private_key_cache(max_entries=64, ttl=600)
+# private_key = algorithm.load_private_key_from_disk_PEM_FORMAT("signing.pem", b"password")
+
+class Private_key_cache:
+    def __init__(self, max_entries = 256, ttl = 300):
+        self.max_entries    = max_entries
+        self.ttl            = ttl
+        self.entries        = OrderedDict()
+        self.paths          = {}
+        self.loading        = {}
+        self.lock           = threading.Lock()
+        self.hits           = 0
+        self.misses         = 0
+    
+    def _identity(self, file_path, stat_result, password):
+        password_digest = hashlib.sha256(password).digest() if password else None
+        return (os.path.abspath(file_path), stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size, password_digest)
+
+    def load(self, file_path, password = None):
+        identity = self._identity(file_path, os.stat(file_path), password)
+        with self.lock:
+            entry = self.entries.get(identity)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(identity)
+                self.hits += 1
+                return entry[0]
+            pending = self.loading.get(identity)
+            owner = pending is None
+            if owner:
+                pending = self.loading[identity] = Future()
+                self.misses += 1
+        if not owner:
+            return pending.result()
+        try:
+            private_key = self._parse(file_path, password)
+            pending.set_result(private_key)
+            return private_key
+        except BaseException as error:
+            pending.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                self.loading.pop(identity, None)
+
+    # Identity is taken from the open file, so it always describes the bytes that were parsed.
+    def _parse(self, file_path, password):
+        with open(file_path, "rb") as key_file:
+            identity = self._identity(file_path, os.fstat(key_file.fileno()), password)
+            pem_data = key_file.read()
+        private_key = serialization.load_pem_private_key(pem_data, password=password, backend=default_backend())
+        with self.lock:
+            stale = self.paths.get(identity[0])
+            if stale is not None and stale != identity:
+                self.entries.pop(stale, None)
+            self.paths[identity[0]] = identity
+            self.entries[identity] = (private_key, time.monotonic() + self.ttl)
+            self.entries.move_to_end(identity)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                if self.paths.get(evicted[0]) == evicted:
+                    del self.paths[evicted[0]]
+        return private_key
+
+    def invalidate(self, file_path):
+        with self.lock:
+            identity = self.paths.pop(os.path.abspath(file_path), None)
+            if identity is not None:
+                self.entries.pop(identity, None)
+
+
+# Batch RSA-PSS signing on a process pool
+#
+# RSA private-key operations are CPU bound. The signer hashes messages in 
+# the calling process and sends only the digests to worker processes, 
+# each of which loaded every signing key once at startup, and signs them
+# with utils.Prehashed. Digests travel in slices of up to batch_size, and
+# signatures come back in the order of the messages.
+#
+# keys maps a key id to (path of a PEM private key, password or None).
+# metrics() reports queue depth (slices submitted but not finished) and 
+# the latency of recent sign_many() calls.
+#
+# Example Usage
+# signer = RSA_Batch_Signer({"release": ("release.pem", b"password")})
+# signatures = signer.sign_many(messages, "release")
+# print(signer.metrics())
+# signer.close()
+
+RSA_SIGNING_HASHES = {
+    "sha256" : hashes.SHA256,
+    "sha384" : hashes.SHA384,
+    "sha512" : hashes.SHA512,
+}
+
+worker_signing_keys = {}
+
+def load_worker_signing_keys(keys):
+    for key_id, (file_path, password) in keys.items():
+        with open(file_path, "rb") as key_file:
+            worker_signing_keys[key_id] = serialization.load_pem_private_key(key_file.read(), password=password)
+
+def sign_prehashed_digests(key_id, digests, hash_name):
+    private_key = worker_signing_keys[key_id]
+    chosen_hash = RSA_SIGNING_HASHES[hash_name]()
+    pss = padding.PSS(mgf=padding.MGF1(chosen_hash), salt_length=padding.PSS.MAX_LENGTH)
+    return [private_key.sign(digest, pss, utils.Prehashed(chosen_hash)) for digest in digests]
+
+class RSA_Batch_Signer:
+    def __init__(self, keys, hash_name = "sha256", workers = None, batch_size = 64):
+        self.hash_name      = hash_name
+        self.workers        = workers or os.cpu_count() or 1
+        self.batch_size     = batch_size
+        self.lock           = threading.Lock()
+        self.queue_depth    = 0
+        self.batches        = 0
+        self.latencies      = deque(maxlen=256)
+        self.executor       = ProcessPoolExecutor(max_workers=self.workers, initializer=load_worker_signing_keys, initargs=(dict(keys),))
+    
+    def digest(self, message):
+        hasher = hashes.Hash(RSA_SIGNING_HASHES[self.hash_name]())
+        hasher.update(message)
+        return hasher.finalize()
+
+    def _slice_finished(self, future):
+        with self.lock:
+            self.queue_depth -= 1
+
+    def sign_many(self, messages, key_id):
+        started = time.perf_counter()
+        digests = [self.digest(message) for message in messages]
+        slice_size = max(1, min(self.batch_size, -(-len(digests) // self.workers)))
+        futures = []
+        for offset in range(0, len(digests), slice_size):
+            with self.lock:
+                self.queue_depth += 1
+            future = self.executor.submit(sign_prehashed_digests, key_id, digests[offset:offset + slice_size], self.hash_name)
+            future.add_done_callback(self._slice_finished)
+            futures.append(future)
+        signatures = []
+        for future in futures:
+            signatures.extend(future.result())
+        with self.lock:
+            self.batches += 1
+            self.latencies.append(time.perf_counter() - started)
+        return signatures
+
+    def sign(self, message, key_id):
+        return self.sign_many([message], key_id)[0]
+
+    def metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                "workers"               : self.workers,
+                "queue_depth"           : self.queue_depth,
+                "batches"               : self.batches,
+                "last_batch_latency"    : self.latencies[-1] if self.latencies else 0.0,
+                "median_batch_latency"  : latencies[len(latencies) // 2] if latencies else 0.0,
+                "max_batch_latency"     : latencies[-1] if latencies else 0.0,
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+# Hybrid RSA-OAEP + AEAD envelope encryption
+#
+# A random 256-bit data key is wrapped once with RSA-OAEP and the payload 
+# is encrypted with an AEAD (AES-256-GCM or ChaCha20-Poly1305) under that 
+# key, so a message of any size costs one RSA operation.
+#
+# Large payloads are streamed in chunks of chunk_size bytes. Each chunk has
+# its own nonce (7-byte random prefix, 4-byte chunk counter, 1-byte final
+# flag), and the whole header is authenticated with every chunk, so chunks
+# cannot be reordered, dropped, truncated or moved between envelopes.
+#
+# Format, version 1 (integers big-endian):
+#
+#   magic "RSAE" | version (1) | aead id (1) | chunk size (4)
+#   | wrapped key length (2) | wrapped key | nonce prefix (7)
+#   then per chunk: length (4, top bit set on the final chunk) | ciphertext and tag
+#
+# Example Usage
+# envelope = RSA_Envelope_Encryption()
+# ciphertext = envelope.encrypt(public_key, payload)
+# payload = envelope.decrypt(private_key, ciphertext)
+#
+# with open("backup.tar", "rb") as source, open("backup.tar.rsae", "wb") as target:
+#     envelope.encrypt_stream(public_key, source, target)
+
+ENVELOPE_MAGIC          = b"RSAE"
+ENVELOPE_VERSION        = 1
+ENVELOPE_AEADS          = {"aes-256-gcm": (1, AESGCM), "chacha20-poly1305": (2, ChaCha20Poly1305)}
+ENVELOPE_FINAL_CHUNK    = 0x80000000
+
+class RSA_Envelope_Encryption:
+    def __init__(self, aead = "aes-256-gcm", chunk_size = 1024 * 1024, hash_type = None):
+        if aead not in ENVELOPE_AEADS:
+            raise ValueError("unsupported AEAD %r" % aead)
+        if not 0 < chunk_size < ENVELOPE_FINAL_CHUNK - 16:
+            raise ValueError("chunk_size out of range")
+        self.aead           = aead
+        self.chunk_size     = chunk_size
+        self.hash_type      = hash_type or hashes.SHA256()
+        self.tag_length     = 16
+        self.thread_buffers = threading.local()
+    
+    def _oaep(self):
+        return padding.OAEP(mgf=padding.MGF1(algorithm=self.hash_type), algorithm=self.hash_type, label=None)
+
+    def _nonce(self, nonce_prefix, counter, final):
+        if counter > 0xFFFFFFFF:
+            raise OverflowError("too many chunks for one envelope, use a larger chunk_size")
+        return nonce_prefix + struct.pack(">IB", counter, 1 if final else 0)
+
+    # Writes the envelope header; returns (header, cipher, nonce prefix).
+    def _begin(self, public_key, writer):
+        aead_id, aead_class = ENVELOPE_AEADS[self.aead]
+        data_key = os.urandom(32)
+        wrapped_key = public_key.encrypt(data_key, self._oaep())
+        nonce_prefix = os.urandom(7)
+        header = ENVELOPE_MAGIC + struct.pack(">BBIH", ENVELOPE_VERSION, aead_id, self.chunk_size, len(wrapped_key)) + wrapped_key + nonce_prefix
+        writer.write(header)
+        return header, aead_class(data_key), nonce_prefix
+
+    def _write_chunk(self, writer, cipher, header, nonce_prefix, counter, chunk, final):
+        ciphertext = cipher.encrypt(self._nonce(nonce_prefix, counter, final), chunk, header)
+        writer.write(struct.pack(">I", len(ciphertext) | (ENVELOPE_FINAL_CHUNK if final else 0)))
+        writer.write(ciphertext)
+
+    # The two read buffers are allocated on first use and reused by later
+    # calls from the same thread.
+    def _stream_buffers(self):
+        buffers = getattr(self.thread_buffers, "buffers", None)
+        if buffers is None or len(buffers[0]) != self.chunk_size:
+            buffers = self.thread_buffers.buffers = [bytearray(self.chunk_size), bytearray(self.chunk_size)]
+        return buffers
+
+    def encrypt_stream(self, public_key, reader, writer):
+        header, cipher, nonce_prefix = self._begin(public_key, writer)
+        buffers = self._stream_buffers()
+        current = 0
+        filled = self._fill(reader, buffers[current])
+        counter = 0
+        while True:
+            # Read one chunk ahead so the last chunk can be flagged as final.
+            following = self._fill(reader, buffers[1 - current]) if filled == self.chunk_size else 0
+            final = following == 0
+            with memoryview(buffers[current])[:filled] as chunk:
+                self._write_chunk(writer, cipher, header, nonce_prefix, counter, chunk, final)
+            if final:
+                return len(header)
+            counter += 1
+            current = 1 - current
+            filled = following
+
+    def _fill(self, reader, buffer):
+        filled = 0
+        view = memoryview(buffer)
+        while filled < len(buffer):
+            bytes_read = reader.readinto(view[filled:])
+            if not bytes_read:
+                break
+            filled += bytes_read
+        return filled
+
+    def _read_exactly(self, reader, length):
+        data = reader.read(length)
+        if len(data) != length:
+            raise ValueError("truncated envelope")
+        return data
+
+    def decrypt_stream(self, private_key, reader, writer):
+        fixed = self._read_exactly(reader, 12)
+        if fixed[:4] != ENVELOPE_MAGIC:
+            raise ValueError("not an RSA envelope")
+        version, aead_id, chunk_size, wrapped_length = struct.unpack(">BBIH", fixed[4:])
+        if version != ENVELOPE_VERSION:
+            raise ValueError("unsupported envelope version %d" % version)
+        aead_classes = {identifier: aead_class for identifier, aead_class in ENVELOPE_AEADS.values()}
+        if aead_id not in aead_classes:
+            raise ValueError("unsupported AEAD id %d" % aead_id)
+        wrapped_key = self._read_exactly(reader, wrapped_length)
+        nonce_prefix = self._read_exactly(reader, 7)
+        header = fixed + wrapped_key + nonce_prefix
+        cipher = aead_classes[aead_id](private_key.decrypt(wrapped_key, self._oaep()))
+        counter = 0
+        while True:
+            length, = struct.unpack(">I", self._read_exactly(reader, 4))
+            final = bool(length & ENVELOPE_FINAL_CHUNK)
+            length &= ~ENVELOPE_FINAL_CHUNK
+            if length > chunk_size + self.tag_length:
+                raise ValueError("chunk larger than the envelope chunk size")
+            ciphertext = self._read_exactly(reader, length)
+            writer.write(cipher.decrypt(self._nonce(nonce_prefix, counter, final), ciphertext, header))
+            if final:
+                break
+            counter += 1
+        if reader.read(1):
+            raise ValueError("trailing data after the final chunk")
+
+    def encrypt(self, public_key, message):
+        if isinstance(message, str):
+            message = bytes(message, encoding="utf8")
+        # The message is already in memory: encrypt slices of it in place
+        # instead of copying it through the stream buffers.
+        writer = io.BytesIO()
+        header, cipher, nonce_prefix = self._begin(public_key, writer)
+        with memoryview(message) as view:
+            length = len(view)
+            for counter, offset in enumerate(range(0, max(length, 1), self.chunk_size)):
+                self._write_chunk(writer, cipher, header, nonce_prefix, counter, view[offset:offset + self.chunk_size], offset + self.chunk_size >= length)
+        return writer.getvalue()
+
+    def decrypt(self, private_key, envelope):
+        writer = io.BytesIO()
+        self.decrypt_stream(private_key, io.BytesIO(envelope), writer)
+        return writer.getvalue()
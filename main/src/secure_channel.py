@@ -0,0 +1,253 @@
+import struct
+import hashlib
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+
+
+# Secure channel
+#
+# A Noise-style transport on top of the X25519 exchange: both sides send
+# an ephemeral X25519 public key (32 bytes), HKDF-SHA256 over the shared
+# secret, salted with a hash of the prologue and both public keys (and a
+# pre-shared key, if any), yields one ChaCha20-Poly1305 key per direction.
+# Without a psk the handshake is unauthenticated, like Noise NN: bind it to
+# an identity by signing the transcript hash or by using a psk.
+#
+# Every frame is
+#
+#   length (4 bytes, big endian, of what follows) | ciphertext | tag (16)
+#
+# with the length as associated data and a 64-bit counter as the nonce
+# (4 zero bytes | counter, little endian). Each direction rekeys itself
+# after rekey_bytes of payload or rekey_messages frames, whichever comes
+# first, with the Noise REKEY function; both ends count the same frames,
+# so no message is exchanged for it.
+#
+# Frames are encrypted into and decrypted from caller-provided buffers
+# (encrypt_into/decrypt_into). The socket adapter reuses one send and one
+# receive buffer, so its data path allocates nothing per frame; the asyncio
+# adapter decrypts into a reused buffer but hands each encrypted frame to 
+# the transport as a new bytearray. A frame that fails authentication 
+# raises InvalidTag and leaves the channel out of sync: close it.
+#
+# Example Usage (sockets)
+# channel = Socket_channel.connect(client_socket, initiator=True)
+# channel.send(payload)
+# received = channel.recv()                   # memoryview, valid until the next recv
+#
+# Example Usage (asyncio)
+# channel = await Stream_channel.connect(reader, writer, initiator=False)
+# await channel.send(payload)
+# received = await channel.recv()
+
+HANDSHAKE_MESSAGE_SIZE  = 32
+FRAME_HEADER_SIZE       = 4
+FRAME_TAG_SIZE          = 16
+MAX_NONCE               = (1 << 64) - 1
+REKEY_NONCE             = struct.pack("<4xQ", MAX_NONCE)
+ZERO_KEY                = bytes(32)
+
+class Channel_cipher_state:
+    def __init__(self, key, rekey_bytes, rekey_messages):
+        self.key            = key
+        self.aead           = ChaCha20Poly1305(key)
+        self.counter        = 0
+        self.bytes          = 0
+        self.rekey_bytes    = rekey_bytes
+        self.rekey_messages = rekey_messages
+        self.rekeys         = 0
+
+    def next_nonce(self, payload_length):
+        if self.counter >= self.rekey_messages or self.bytes >= self.rekey_bytes:
+            self.rekey()
+        if self.counter >= MAX_NONCE:
+            raise ValueError("channel nonce space exhausted")
+        nonce = struct.pack("<4xQ", self.counter)
+        self.counter += 1
+        self.bytes += payload_length
+        return nonce
+
+    # REKEY(k) = first 32 bytes of ENCRYPT(k, maxnonce, "", zeros).
+    def rekey(self):
+        self.key = self.aead.encrypt(REKEY_NONCE, ZERO_KEY, b"")[:32]
+        self.aead = ChaCha20Poly1305(self.key)
+        self.counter = 0
+        self.bytes = 0
+        self.rekeys += 1
+
+
+class Secure_channel:
+    def __init__(self, initiator, prologue = b"", psk = None, rekey_bytes = 1 << 32, rekey_messages = 1 << 20, max_frame_size = 1 << 20, key_pool = None):
+        self.initiator      = initiator
+        self.prologue       = prologue
+        self.psk            = psk
+        self.rekey_bytes    = rekey_bytes
+        self.rekey_messages = rekey_messages
+        self.max_frame_size = max_frame_size
+        # optional crypto_utility.Ephemeral_key_pool; its keys are single use anyway
+        self.private_key    = key_pool.acquire("x25519") if key_pool is not None else X25519PrivateKey.generate()
+        self.public_bytes   = self.private_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+        self.handshake_hash = None
+        self.sender         = None
+        self.receiver       = None
+
+    @property
+    def established(self):
+        return self.sender is not None
+
+    def handshake_message(self):
+        return self.public_bytes
+
+    def complete_handshake(self, peer_message):
+        if self.established:
+            raise ValueError("handshake already completed")
+        if len(peer_message) != HANDSHAKE_MESSAGE_SIZE:
+            raise ValueError("handshake message must be %d bytes" % HANDSHAKE_MESSAGE_SIZE)
+        peer_message = bytes(peer_message)
+        shared_key = self.private_key.exchange(X25519PublicKey.from_public_bytes(peer_message))
+        self.private_key = None
+        initiator_key, responder_key = (self.public_bytes, peer_message) if self.initiator else (peer_message, self.public_bytes)
+        transcript = hashlib.sha256(b"secure-channel-x25519-chachapoly-sha256")
+        for field in (self.prologue, initiator_key, responder_key, hashlib.sha256(self.psk).digest() if self.psk else b""):
+            transcript.update(struct.pack(">I", len(field)))
+            transcript.update(field)
+        self.handshake_hash = transcript.digest()
+        keys = HKDF(algorithm=hashes.SHA256(), length=64, salt=self.handshake_hash, info=b"secure channel keys").derive(shared_key)
+        initiator_state = Channel_cipher_state(keys[:32], self.rekey_bytes, self.rekey_messages)
+        responder_state = Channel_cipher_state(keys[32:], self.rekey_bytes, self.rekey_messages)
+        self.sender, self.receiver = (initiator_state, responder_state) if self.initiator else (responder_state, initiator_state)
+        return self.handshake_hash
+
+    @staticmethod
+    def frame_size(payload_length):
+        return FRAME_HEADER_SIZE + payload_length + FRAME_TAG_SIZE
+
+    # Encrypts payload into out[:frame_size(len(payload))] and returns the frame size.
+    def encrypt_frame_into(self, payload, out):
+        payload_length = len(payload)
+        if payload_length > self.max_frame_size:
+            raise ValueError("payload of %d bytes exceeds max_frame_size" % payload_length)
+        frame_length = payload_length + FRAME_TAG_SIZE
+        out = memoryview(out)
+        struct.pack_into(">I", out, 0, frame_length)
+        header = out[:FRAME_HEADER_SIZE]
+        self.sender.aead.encrypt_into(self.sender.next_nonce(payload_length), payload, header, out[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + frame_length])
+        return FRAME_HEADER_SIZE + frame_length
+
+    def encrypt_frame(self, payload):
+        out = bytearray(self.frame_size(len(payload)))
+        self.encrypt_frame_into(payload, out)
+        return out
+
+    # Reads the length from a frame header and checks it against max_frame_size.
+    def frame_length(self, header):
+        frame_length = struct.unpack_from(">I", header)[0]
+        if not FRAME_TAG_SIZE <= frame_length <= self.max_frame_size + FRAME_TAG_SIZE:
+            raise ValueError("invalid frame length %d" % frame_length)
+        return frame_length
+
+    # header is the 4 length bytes, body the ciphertext and tag that follow.
+    # Decrypts into out and returns the payload length; raises InvalidTag
+    # on a forged, reordered or replayed frame.
+    def decrypt_frame_into(self, header, body, out):
+        payload_length = len(body) - FRAME_TAG_SIZE
+        self.receiver.aead.decrypt_into(self.receiver.next_nonce(payload_length), body, header, memoryview(out)[:payload_length])
+        return payload_length
+
+    def decrypt_frame(self, frame):
+        frame = memoryview(frame)
+        frame_length = self.frame_length(frame[:FRAME_HEADER_SIZE])
+        if len(frame) != FRAME_HEADER_SIZE + frame_length:
+            raise ValueError("truncated frame")
+        out = bytearray(frame_length - FRAME_TAG_SIZE)
+        self.decrypt_frame_into(frame[:FRAME_HEADER_SIZE], frame[FRAME_HEADER_SIZE:], out)
+        return out
+
+
+# Blocking socket adapter
+class Socket_channel:
+    def __init__(self, sock, channel):
+        self.sock           = sock
+        self.channel        = channel
+        self.send_buffer    = memoryview(bytearray(channel.frame_size(channel.max_frame_size)))
+        self.receive_buffer = memoryview(bytearray(channel.frame_size(channel.max_frame_size)))
+        self.payload_buffer = memoryview(bytearray(channel.max_frame_size))
+
+    @classmethod
+    def connect(cls, sock, initiator, **channel_options):
+        channel = Secure_channel(initiator, **channel_options)
+        sock.sendall(channel.handshake_message())
+        peer_message = bytearray(HANDSHAKE_MESSAGE_SIZE)
+        cls._recv_exactly(sock, memoryview(peer_message))
+        channel.complete_handshake(peer_message)
+        return cls(sock, channel)
+
+    @staticmethod
+    def _recv_exactly(sock, view):
+        received = 0
+        while received < len(view):
+            count = sock.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError("connection closed by peer")
+            received += count
+
+    # Sends data as one or more frames of at most max_frame_size bytes.
+    def send(self, data):
+        data = memoryview(data).cast("B")
+        maximum = self.channel.max_frame_size
+        for offset in range(0, max(len(data), 1), maximum):
+            frame_size = self.channel.encrypt_frame_into(data[offset:offset + maximum], self.send_buffer)
+            self.sock.sendall(self.send_buffer[:frame_size])
+
+    # Receives one frame into out (at least max_frame_size bytes, or the
+    # channel's own buffer) and returns a memoryview of the payload.
+    def recv(self, out = None):
+        out = self.payload_buffer if out is None else memoryview(out)
+        header = self.receive_buffer[:FRAME_HEADER_SIZE]
+        self._recv_exactly(self.sock, header)
+        frame_length = self.channel.frame_length(header)
+        body = self.receive_buffer[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + frame_length]
+        self._recv_exactly(self.sock, body)
+        return out[:self.channel.decrypt_frame_into(header, body, out)]
+
+    def close(self):
+        self.sock.close()
+
+
+# asyncio StreamReader/StreamWriter adapter
+class Stream_channel:
+    def __init__(self, reader, writer, channel):
+        self.reader         = reader
+        self.writer         = writer
+        self.channel        = channel
+        self.payload_buffer = memoryview(bytearray(channel.max_frame_size))
+
+    @classmethod
+    async def connect(cls, reader, writer, initiator, **channel_options):
+        channel = Secure_channel(initiator, **channel_options)
+        writer.write(channel.handshake_message())
+        await writer.drain()
+        channel.complete_handshake(await reader.readexactly(HANDSHAKE_MESSAGE_SIZE))
+        return cls(reader, writer, channel)
+
+    # The transport keeps a reference to what is written, so every frame
+    # gets its own bytearray here instead of a shared send buffer.
+    async def send(self, data):
+        data = memoryview(data).cast("B")
+        maximum = self.channel.max_frame_size
+        for offset in range(0, max(len(data), 1), maximum):
+            self.writer.write(self.channel.encrypt_frame(data[offset:offset + maximum]))
+            await self.writer.drain()
+
+    async def recv(self, out = None):
+        out = self.payload_buffer if out is None else memoryview(out)
+        header = await self.reader.readexactly(FRAME_HEADER_SIZE)
+        body = await self.reader.readexactly(self.channel.frame_length(header))
+        return out[:self.channel.decrypt_frame_into(header, body, out)]
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
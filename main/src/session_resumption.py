@@ -0,0 +1,191 @@
+import os
+import time
+import struct
+import threading
+from collections import OrderedDict
+from cryptography.hazmat.primitives import hashes
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.hkdf import HKDFExpand
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+# Session resumption
+#
+# A full X25519/ECDH/DH handshake costs a public-key operation on both sides
+# every time the same peer reconnects. After one full exchange the server
+# derives a resumption secret from the shared key and hands the client an
+# encrypted session ticket that carries it. On reconnect the client sends
+# the ticket and a fresh nonce, the server decrypts it and both sides derive
+# new traffic keys from the resumption secret and both nonces with HKDF only:
+# the reconnect costs one AES-GCM decryption and a few HMACs.
+#
+# Tickets are single use. The issuer remembers every ticket id it issued
+# in a bounded TTL cache and removes the id on redemption, so a replayed
+# ticket (or one evicted from a full cache) is rejected and the peer falls
+# back to a full handshake. Each resumption issues the next ticket, bound to
+# a new resumption secret, so the chain never reuses key material.
+#
+#   ticket = version(1) | key id(4) | ticket id(16) | nonce(12)
+#            | AES-256-GCM(expiry(8) | resumption secret), aad = first 21 bytes
+#
+# Example Usage (server)
+# issuer = Session_ticket_issuer(ttl=3600)
+# ticket, secret = issuer.issue(derived_key)                  # after a full handshake
+# ...
+# resumed = issuer.resume(ticket, client_nonce, server_nonce)
+# if resumed is None:
+#     pass                                                     # full handshake
+# client_key, server_key, next_ticket = resumed
+#
+# Example Usage (client)
+# store = Session_ticket_store()
+# store.put("peer.example:443", ticket, secret)
+# ticket, secret = store.take("peer.example:443")
+# client_key, server_key = derive_traffic_keys(secret, client_nonce, server_nonce)
+
+TICKET_VERSION      = 1
+TICKET_HEADER_SIZE  = 1 + 4 + 16
+TICKET_NONCE_SIZE   = 12
+SESSION_NONCE_SIZE  = 32
+
+def _hkdf_expand(secret, info, length, hash_algorithm = None):
+    return HKDFExpand(algorithm=hash_algorithm or hashes.SHA256(), length=length, info=info).derive(secret)
+
+# The resumption secret is bound to the handshake transcript (both public
+# keys, for instance) so a ticket cannot be moved to another session.
+def resumption_secret_from_shared_key(shared_key, transcript = b"", length = 32, hash_algorithm = None):
+    return HKDF(algorithm=hash_algorithm or hashes.SHA256(), length=length, salt=transcript or None, info=b"session resumption").derive(shared_key)
+
+# Returns (client_key, server_key), one per direction.
+def derive_traffic_keys(resumption_secret, client_nonce, server_nonce, key_length = 32, hash_algorithm = None):
+    if len(client_nonce) < 16 or len(server_nonce) < 16:
+        raise ValueError("session nonces must be at least 16 bytes")
+    hash_algorithm = hash_algorithm or hashes.SHA256()
+    session_secret = HKDF(algorithm=hash_algorithm, length=hash_algorithm.digest_size, salt=client_nonce + server_nonce, info=b"resumed session").derive(resumption_secret)
+    return _hkdf_expand(session_secret, b"client traffic key", key_length, hash_algorithm), _hkdf_expand(session_secret, b"server traffic key", key_length, hash_algorithm)
+
+def next_resumption_secret(resumption_secret, client_nonce, server_nonce, hash_algorithm = None):
+    return _hkdf_expand(resumption_secret, b"next resumption secret" + client_nonce + server_nonce, len(resumption_secret), hash_algorithm)
+
+def generate_session_nonce():
+    return os.urandom(SESSION_NONCE_SIZE)
+
+
+class Session_ticket_issuer:
+    def __init__(self, ticket_key = None, ttl = 3600, max_entries = 65536):
+        self.ttl            = ttl
+        self.max_entries    = max_entries
+        self.ticket_keys    = OrderedDict()
+        self.key_id         = None
+        self.issued         = OrderedDict()  # ticket id -> expiry, oldest first
+        self.lock           = threading.Lock()
+        self.issued_count   = 0
+        self.resumed        = 0
+        self.rejected       = 0
+        self.rotate_key(ticket_key)
+
+    # New tickets use the new key; tickets under the previous key stay
+    # redeemable until they expire, older keys are dropped.
+    def rotate_key(self, ticket_key = None):
+        with self.lock:
+            self.key_id = os.urandom(4)
+            self.ticket_keys[self.key_id] = AESGCM(ticket_key or AESGCM.generate_key(bit_length=256))
+            while len(self.ticket_keys) > 2:
+                self.ticket_keys.popitem(last=False)
+
+    def _expire(self, now):
+        while self.issued:
+            ticket_id, expiry = next(iter(self.issued.items()))
+            if expiry > now and len(self.issued) <= self.max_entries:
+                break
+            del self.issued[ticket_id]
+
+    # Returns (ticket, resumption_secret) for a session that just finished
+    # a full handshake (or a resumption). shared_key is the raw exchange
+    # output or the derived key; pass resumption_secret to chain tickets.
+    def issue(self, shared_key = None, transcript = b"", resumption_secret = None):
+        if resumption_secret is None:
+            resumption_secret = resumption_secret_from_shared_key(shared_key, transcript)
+        ticket_id = os.urandom(16)
+        nonce = os.urandom(TICKET_NONCE_SIZE)
+        expiry = time.time() + self.ttl
+        with self.lock:
+            header = struct.pack(">B4s16s", TICKET_VERSION, self.key_id, ticket_id)
+            sealed = self.ticket_keys[self.key_id].encrypt(nonce, struct.pack(">d", expiry) + resumption_secret, header)
+            self.issued[ticket_id] = expiry
+            self.issued_count += 1
+            self._expire(time.time())
+        return header + nonce + sealed, resumption_secret
+
+    # Returns the resumption secret, or None if the ticket is unknown,
+    # tampered with, expired or was already redeemed.
+    def redeem(self, ticket):
+        if len(ticket) <= TICKET_HEADER_SIZE + TICKET_NONCE_SIZE:
+            return self._reject()
+        version, key_id, ticket_id = struct.unpack(">B4s16s", ticket[:TICKET_HEADER_SIZE])
+        with self.lock:
+            self._expire(time.time())
+            ticket_key = self.ticket_keys.get(key_id)
+            if version != TICKET_VERSION or ticket_key is None or ticket_id not in self.issued:
+                return self._reject()
+            try:
+                plaintext = ticket_key.decrypt(ticket[TICKET_HEADER_SIZE:TICKET_HEADER_SIZE + TICKET_NONCE_SIZE], ticket[TICKET_HEADER_SIZE + TICKET_NONCE_SIZE:], ticket[:TICKET_HEADER_SIZE])
+            except InvalidTag:
+                return self._reject()
+            del self.issued[ticket_id]
+            if struct.unpack(">d", plaintext[:8])[0] <= time.time():
+                return self._reject()
+            self.resumed += 1
+        return plaintext[8:]
+
+    def _reject(self):
+        self.rejected += 1
+        return None
+
+    # Redeems the ticket and returns (client_key, server_key, next_ticket),
+    # or None when the peer has to run a full handshake.
+    def resume(self, ticket, client_nonce, server_nonce):
+        resumption_secret = self.redeem(ticket)
+        if resumption_secret is None:
+            return None
+        client_key, server_key = derive_traffic_keys(resumption_secret, client_nonce, server_nonce)
+        next_ticket, _ = self.issue(resumption_secret=next_resumption_secret(resumption_secret, client_nonce, server_nonce))
+        return client_key, server_key, next_ticket
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "outstanding"   : len(self.issued),
+                "issued"        : self.issued_count,
+                "resumed"       : self.resumed,
+                "rejected"      : self.rejected,
+            }
+
+
+# Client side: one ticket per peer, handed out once.
+class Session_ticket_store:
+    def __init__(self, ttl = 3600, max_entries = 1024):
+        self.ttl            = ttl
+        self.max_entries    = max_entries
+        self.tickets        = OrderedDict()
+        self.lock           = threading.Lock()
+
+    def put(self, peer, ticket, resumption_secret):
+        with self.lock:
+            self.tickets.pop(peer, None)
+            self.tickets[peer] = (ticket, resumption_secret, time.monotonic() + self.ttl)
+            while len(self.tickets) > self.max_entries:
+                self.tickets.popitem(last=False)
+
+    # Returns (ticket, resumption_secret) or None; the entry is removed either way.
+    def take(self, peer):
+        with self.lock:
+            entry = self.tickets.pop(peer, None)
+        if entry is None or entry[2] <= time.monotonic():
+            return None
+        return entry[0], entry[1]
+
+    # After a resumption the client derives the secret the server bound to next_ticket.
+    def put_next(self, peer, next_ticket, resumption_secret, client_nonce, server_nonce):
+        self.put(peer, next_ticket, next_resumption_secret(resumption_secret, client_nonce, server_nonce))
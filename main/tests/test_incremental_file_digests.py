@@ -0,0 +1,52 @@
+import os
+
+from message_authentication import Incremental_file_digests
+
+BLOCK_SIZE = 64 * 1024
+
+
+def _write_file(path, block_count):
+    with open(path, "wb") as file_object:
+        file_object.write(os.urandom(BLOCK_SIZE * block_count))
+
+
+def _touch(path):
+    stat_result = os.stat(path)
+    os.utime(path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1000000000))
+
+
+def test_journal_pass_keeps_the_next_call_incremental(tmp_path):
+    path = str(tmp_path / "volume.img")
+    _write_file(path, 8)
+    incremental = Incremental_file_digests(block_size=BLOCK_SIZE, sample_size=512)
+    manifest = incremental.create_manifest(path)
+
+    with open(path, "r+b") as file_object:
+        file_object.seek(100)
+        file_object.write(b"journal")
+    _touch(path)
+    root, rehashed = incremental.update_digest(path, manifest, dirty_ranges=[(100, 7)])
+    assert rehashed == [0]
+    assert root == incremental.tree.tree_digest_file(path)
+
+    assert incremental.update_digest(path, manifest) == (root, [])
+    assert incremental.update_digest(path, manifest, dirty_ranges=[]) == (root, [])
+
+
+def test_change_without_dirty_ranges_rehashes_every_block(tmp_path):
+    path = str(tmp_path / "volume.img")
+    _write_file(path, 8)
+    incremental = Incremental_file_digests(block_size=BLOCK_SIZE, sample_size=512)
+    manifest = incremental.create_manifest(path)
+
+    with open(path, "r+b") as file_object:
+        file_object.seek(3 * BLOCK_SIZE + BLOCK_SIZE // 2)
+        file_object.write(b"middle")
+    _touch(path)
+    _, rehashed = incremental.update_digest(path, manifest, trust_samples=True)
+    assert rehashed == []
+
+    root, rehashed = incremental.update_digest(path, manifest)
+    assert rehashed == list(range(8))
+    assert root == incremental.tree.tree_digest_file(path)
+    assert incremental.update_digest(path, manifest) == (root, [])